@@ -0,0 +1,257 @@
+from collections import Mapping
+from itertools import count, imap, izip
+
+from numpy import arange, argsort, array, empty, float64, full, int32, lexsort, searchsorted
+
+from grid import polygonedges, Grid
+import instrument
+
+# grow a table to hold at least count rows, doubling capacity to keep
+# appends amortized constant time
+def _reserve(table, count, fill):
+    if count <= len(table):
+        return table
+    grown = full((max(count, 2 * len(table), 12),) + table.shape[1:], fill, table.dtype)
+    grown[:len(table)] = table
+    return grown
+
+# order of the rows of an (N,3) location array when sorted as tuples, as
+# _Ids searches them
+def locationorder(locations):
+    return lexsort(locations.T[::-1]).astype(int32)
+
+# Sequence of the location tuples of an (N,3) array's rows, made as they are
+# read, until one is appended, when they are all made into a list
+class _Keys(object):
+    def __init__(self, locations):
+        self._locations, self._list = locations, None
+
+    def __getitem__(self, i):
+        if self._list is not None:
+            return self._list[i]
+        if isinstance(i, slice):
+            return map(tuple, self._locations[i].tolist())
+        return tuple(self._locations[i].tolist())
+
+    def __iter__(self):
+        if self._list is not None:
+            return iter(self._list)
+        return imap(tuple, self._locations.tolist())
+
+    def __len__(self):
+        return len(self._locations) if self._list is None else len(self._list)
+
+    def append(self, key):
+        if self._list is None:
+            self._list = map(tuple, self._locations.tolist())
+        self._list.append(key)
+
+# Mapping from the location tuples of an (N,3) array's rows, sorted in
+# location order, to their IDs, found by binary search until one is added,
+# when they are all made into a dictionary
+class _Ids(object):
+    def __init__(self, locations):
+        self._locations, self._dict = locations, None
+        self._rows = locations.view([(axis, locations.dtype) for axis in 'xyz']).ravel()
+
+    def _find(self, key):
+        if self._dict is not None:
+            return self._dict.get(key, -1)
+        i = searchsorted(self._rows, array(key, self._rows.dtype))
+        if i < len(self._rows) and tuple(self._locations[i].tolist()) == key:
+            return int(i)
+        return -1
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return i
+
+    def __setitem__(self, key, i):
+        if self._dict is None:
+            self._dict = dict(izip(imap(tuple, self._locations.tolist()), count()))
+        self._dict[key] = i
+
+# Read-only view of an ArrayGrid's faces, mapping each face location to the
+# list of its vertex locations, as in Grid.faces
+class FaceView(Mapping):
+    def __init__(self, grid):
+        self._grid = grid
+
+    def __getitem__(self, face):
+        grid = self._grid
+        row = grid._facevertices[grid._faceids[face]].tolist()
+        return [grid._vertexkeys[v] for v in row if v >= 0]
+
+    def __contains__(self, face):
+        return face in self._grid._faceids
+
+    def __iter__(self):
+        return iter(self._grid._facekeys)
+
+    def __len__(self):
+        return len(self._grid._facekeys)
+
+# Read-only view of an ArrayGrid's vertices, mapping each vertex location to
+# the set of its adjacent face locations, as in Grid.vertices
+class VertexView(Mapping):
+    def __init__(self, grid):
+        self._grid = grid
+
+    def __getitem__(self, vertex):
+        grid = self._grid
+        row = grid._vertexfaces[grid._vertexids[vertex]].tolist()
+        return set([grid._facekeys[f] for f in row if f >= 0])
+
+    def __contains__(self, vertex):
+        return vertex in self._grid._vertexids
+
+    def __iter__(self):
+        return iter(self._grid._vertexkeys)
+
+    def __len__(self):
+        return len(self._grid._vertexkeys)
+
+# A Grid backed by flat arrays instead of dictionaries of lists and sets
+#
+# Each face and vertex is given an integer ID in order of creation. Their
+# locations are kept in contiguous (N,3) float64 arrays, face->vertex
+# adjacency in an (N,6) int32 table and vertex->face adjacency in an (N,3)
+# int32 table, with -1 padding the missing sixth vertex of pentagons and the
+# faces of vertices not yet populated.
+#
+# The faces and vertices attributes are views presenting the same mappings
+# as Grid, so the rest of the application can use either interchangeably.
+#
+# The tables can be supplied at construction as (face locations, face->vertex,
+# vertex locations, vertex->face) arrays, with faces and vertices numbered in
+# location order (see locationorder), e.g. memory-mapped from a file (see
+# gridfile); they are copied only once the grid grows beyond them. Until
+# then locations are looked up by binary search and made into tuples as they
+# are read, rather than all read into dictionaries.
+class ArrayGrid(Grid):
+    def __init__(self, prev=None, arrays=None):
+        self._arrays = arrays
+        Grid.__init__(self, prev)
+
+    def _initstorage(self):
+        if self._arrays is None:
+            self._settables(
+                empty((0, 3), float64), full((0, 6), -1, int32),
+                empty((0, 3), float64), full((0, 3), -1, int32),
+                facekeys=[], vertexkeys=[])
+        else:
+            self._settables(*self._arrays)
+            self._arrays = None
+
+        self.faces = FaceView(self)
+        self.vertices = VertexView(self)
+
+    def _settables(self, facelocations, facevertices, vertexlocations, vertexfaces,
+                   facekeys=None, vertexkeys=None):
+        self._facelocations, self._facevertices = facelocations, facevertices
+        self._vertexlocations, self._vertexfaces = vertexlocations, vertexfaces
+
+        # location tuple <-> ID
+        if facekeys is None:
+            self._faceids, self._facekeys = _Ids(facelocations), _Keys(facelocations)
+            self._journal = _Keys(facelocations)
+        else:
+            self._faceids, self._facekeys = dict(izip(facekeys, count())), list(facekeys)
+            self._journal.extend(self._facekeys)
+        instrument.count('faces populated', len(self._facekeys))
+        if vertexkeys is None:
+            self._vertexids, self._vertexkeys = _Ids(vertexlocations), _Keys(vertexlocations)
+        else:
+            self._vertexids, self._vertexkeys = dict(izip(vertexkeys, count())), list(vertexkeys)
+
+    def _faceid(self, face):
+        if face in self._faceids:
+            return self._faceids[face]
+        f = len(self._facekeys)
+        self._facelocations = _reserve(self._facelocations, f + 1, 0)
+        self._facevertices = _reserve(self._facevertices, f + 1, -1)
+        self._facelocations[f] = face
+        self._faceids[face] = f
+        self._facekeys.append(face)
+        self._journal.append(face)
+        instrument.count('faces populated')
+        self._hold([face], 1)
+        return f
+
+    def _vertexid(self, vertex):
+        if vertex in self._vertexids:
+            return self._vertexids[vertex]
+        v = len(self._vertexkeys)
+        self._vertexlocations = _reserve(self._vertexlocations, v + 1, 0)
+        self._vertexfaces = _reserve(self._vertexfaces, v + 1, -1)
+        self._vertexlocations[v] = vertex
+        self._vertexids[vertex] = v
+        self._vertexkeys.append(vertex)
+        return v
+
+    def _setface(self, face, vertices):
+        f = self._faceid(face)
+        row = [self._vertexid(vertex) for vertex in vertices]
+        self._facevertices[f] = row + [-1] * (6 - len(row))
+        for v in row:
+            faces = self._vertexfaces[v]
+            for i in range(3):
+                if faces[i] == f:
+                    break
+                if faces[i] < 0:
+                    faces[i] = f
+                    break
+
+    def _setlevel(self, faces, vertices, table, progress=None):
+        if len(self._facekeys) > 0:
+            Grid._setlevel(self, faces, vertices, table, progress)
+            return
+
+        # invert the face->vertex table, listing each vertex's faces in ID order
+        fs, ks = (table >= 0).nonzero()
+        vs = table[fs, ks]
+        order = argsort(vs, kind='mergesort')
+        fs, vs = fs[order], vs[order]
+        ranks = arange(len(vs)) - searchsorted(vs, arange(len(vertices)))[vs]
+        vertexfaces = full((len(vertices), 3), -1, int32)
+        vertexfaces[vs, ranks] = fs
+
+        self._settables(
+            array(faces, float64), table.astype(int32),
+            array(vertices, float64), vertexfaces,
+            facekeys=faces, vertexkeys=vertices)
+        self._hold(faces, 1)
+
+    def _tables(self):
+        return (list(self._facekeys), self.facelocations(), self._facevertices[:len(self._facekeys)],
+                list(self._vertexkeys), self.vertexlocations(), self._vertexfaces[:len(self._vertexkeys)])
+
+    def _complete(self):
+        return (self._vertexfaces[:len(self._vertexkeys)] >= 0).all()
+
+    # edges are computed rather than indexed to keep per-face storage fixed
+    def edges(self, face):
+        return polygonedges(self.faces[face])
+
+    def neighbors(self, face):
+        return [self.neighbor(face, edge) for edge in self.edges(face)]
+
+    def neighbor(self, face, border):
+        # each edge has two common faces (if they exist in the grid)
+        f1, f2 = [set(self._vertexfaces[self._vertexids[v]].tolist()) for v in border]
+        common = (f1 & f2) - { -1 }
+        if len(common) == 2:
+            return self._facekeys[list(common - { self._faceids[face] })[0]]
+
+    # locations of all faces as an (N,3) array, rows in ID order
+    def facelocations(self):
+        return self._facelocations[:len(self._facekeys)]
+
+    # locations of all vertices as an (N,3) array, rows in ID order
+    def vertexlocations(self):
+        return self._vertexlocations[:len(self._vertexkeys)]
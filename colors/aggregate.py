@@ -0,0 +1,182 @@
+from os.path import exists
+
+import numpy
+from numpy import arange, array, bincount, cross, full, int32, maximum, zeros
+
+import base
+
+modes = ['mean', 'min', 'max', 'majority']
+
+# cells of a raster within each of a set of tiles, given as a mapping of
+# faces to their corners, as parallel arrays of indices into the flattened
+# raster and tile numbers, numbering the tiles by their position in sorted
+# order
+#
+# Candidate cells are those within the rows and columns spanned by each
+# tile's corners and the furthest points of its sides. A tile wrapping
+# across the edge of the raster spans a range of columns at each end, and
+# only a tile containing a pole takes every column, from its corners to the
+# pole. The candidates of all tiles are tested together for lying within
+# their tile's convex polygon, about batchsize at a time, so only cells near
+# populated tiles are visited. A cell on the border of two tiles goes to the
+# later.
+def tilecells(tiles, raster, batchsize=2**18):
+    rows, columns = raster.shape(raster.level)
+    faces = sorted(tiles)
+    if len(faces) == 0:
+        return zeros(0, int), zeros(0, int32)
+    centers = array(faces)
+    # pentagons repeat a corner, making a side that passes either test
+    corners = array([tiles[face] + tiles[face][-1:] * (6 - len(tiles[face])) for face in faces])
+    normals = cross(corners, numpy.roll(corners, -1, axis=1))
+
+    cornerrows, cornercolumns = [a.reshape(len(faces), -1) for a in raster.cells(corners.reshape(-1, 3))]
+    # sides bulge towards the poles, their furthest points north and south
+    # lying between their corners
+    extremes = [corners]
+    for pole in (0, 1, 0), (0, -1, 0):
+        furthest = pole - normals * (normals.dot(pole) / maximum((normals * normals).sum(axis=2), 1e-300))[...,None]
+        between = ((cross(corners, furthest) * normals).sum(axis=2) > 0) & (
+            (cross(furthest, numpy.roll(corners, -1, axis=1)) * normals).sum(axis=2) > 0)
+        extremes.append(numpy.where(between[...,None], furthest, corners))
+    extremerows = raster.cells(numpy.concatenate(extremes, axis=1).reshape(-1, 3))[0].reshape(len(faces), -1)
+    top, bottom = extremerows.min(axis=1), extremerows.max(axis=1) + 1
+    left, right = cornercolumns.min(axis=1), cornercolumns.max(axis=1) + 1
+    tiles = arange(len(faces))
+
+    # (tile, top, bottom, left, right) boxes of candidate cells
+    wrapped = right - left > columns // 2
+    east = cornercolumns >= columns // 2
+    boxes = [
+        (tiles[~wrapped], top[~wrapped], bottom[~wrapped], left[~wrapped], right[~wrapped]),
+        (tiles[wrapped], top[wrapped], bottom[wrapped],
+         numpy.where(east, cornercolumns, columns).min(axis=1)[wrapped], full(wrapped.sum(), columns)),
+        (tiles[wrapped], top[wrapped], bottom[wrapped],
+         zeros(wrapped.sum(), int), numpy.where(east, -1, cornercolumns).max(axis=1)[wrapped] + 1)]
+    for pole, northern in ((0, 1, 0), True), ((0, -1, 0), False):
+        sides = normals.dot(pole)
+        polar = ((centers.dot(pole) > 0) &
+                 ((sides >= 0).all(axis=1) | (sides <= 0).all(axis=1))).nonzero()[0]
+        if len(polar) > 0:
+            boxes = [tuple(a[~numpy.in1d(box[0], polar)] for a in box) for box in boxes]
+            boxes.append((polar, top[polar] if northern else zeros(len(polar), int),
+                          full(len(polar), rows) if northern else bottom[polar],
+                          zeros(len(polar), int), full(len(polar), columns)))
+    boxtiles, tops, bottoms, lefts, rights = [numpy.concatenate(a) for a in zip(*boxes)]
+    widths = rights - lefts
+    counts = (bottoms - tops) * widths
+    ends = counts.cumsum()
+
+    found = []
+    start = 0
+    while start < len(boxtiles):
+        done = ends[start] - counts[start]
+        stop = max(start + 1, numpy.searchsorted(ends, done + batchsize, 'right'))
+        box = numpy.repeat(arange(start, stop), counts[start:stop])
+        offsets = arange(len(box)) - (ends[box] - counts[box] - done)
+        cellrows = tops[box] + offsets // widths[box]
+        cellcolumns = lefts[box] + offsets % widths[box]
+        tile = boxtiles[box]
+
+        points = raster.centers(cellrows, cellcolumns)
+        inside = numpy.einsum('ij,ij->i', points, centers[tile]) > 0
+        sides = numpy.einsum('ij,ikj->ik', points, normals[tile])
+        inside &= (sides >= 0).all(axis=1) | (sides <= 0).all(axis=1)
+        found.append((cellrows[inside] * columns + cellcolumns[inside], tile[inside]))
+        start = stop
+
+    cells, tiles = [numpy.concatenate(a) for a in zip(*found)]
+    order = (cells * len(faces) + tiles).argsort()
+    cells, tiles = cells[order], tiles[order]
+    last = numpy.append(cells[1:] != cells[:-1], True)
+    return cells[last], tiles[last].astype(int32)
+
+# Cell -> tile assignment for a raster, numbering the grid's tiles by their
+# position in sorted order, with -1 for cells outside every populated tile
+#
+# The raster gives its shape at its level, cells mapping an (N,3) array of
+# locations to the rows and columns containing them and centers mapping rows
+# and columns to locations.
+def assign(grid, raster):
+    return _table(raster, *tilecells(grid.faces, raster))
+
+def _table(raster, cells, tiles):
+    rows, columns = raster.shape(raster.level)
+    table = full(rows * columns, -1, int32)
+    table[cells] = tiles
+    return table
+
+# Provider coloring a grid's tiles from every raster cell they contain
+#
+# Each tile gets the mean, min or max of its cells, weighted by cell area
+# for the mean, or for majority the mean of its cells in its most common
+# class. Tiles too small to contain a cell, and tiles populated after the
+# provider was made, fall back to the raster's own color at their center.
+#
+# Recoloring takes a single pass over the cell -> tile table, which is
+# saved to tablefile if given so that grids of the same size can load it
+# rather than assigning cells again. Only fully populated grids should be
+# given a tablefile, partial grids numbering their tiles differently.
+class Aggregate(base.Provider):
+    def __init__(self, raster, grid, mode='mean', tablefile=None):
+        if mode not in modes:
+            raise ValueError('unknown aggregation mode {}'.format(mode))
+        self.raster = raster
+        self.name = raster.name
+        # copied at once, as a partial grid may go on being populated while
+        # its provider is made on another thread
+        corners = dict(grid.faces)
+        faces = sorted(corners)
+        self._tiles = dict((face, i) for i, face in enumerate(faces))
+
+        if tablefile is not None and exists(tablefile):
+            table = numpy.load(tablefile, mmap_mode='r')
+            cells = (table >= 0).nonzero()[0]
+            tiles = table[cells]
+        else:
+            cells, tiles = tilecells(corners, raster)
+            if tablefile is not None:
+                numpy.save(tablefile, _table(raster, cells, tiles))
+
+        count = len(faces)
+        weights = raster.weights(cells)
+        values = raster.values(1 if mode == 'min' else 2 if mode == 'max' else 0)[cells]
+
+        if mode == 'mean':
+            total = bincount(tiles, weights, count)
+            tilevalues = bincount(tiles, weights * values, count) / maximum(total, 1e-300)
+        elif mode == 'min':
+            tilevalues = full(count, numpy.inf)
+            numpy.minimum.at(tilevalues, tiles, values)
+            total = numpy.isfinite(tilevalues)
+        elif mode == 'max':
+            tilevalues = full(count, -numpy.inf)
+            numpy.maximum.at(tilevalues, tiles, values)
+            total = numpy.isfinite(tilevalues)
+        else:
+            classes = raster.classcount
+            keys = tiles * classes + raster.classes(values)
+            total = bincount(keys, weights, count * classes).reshape(count, classes)
+            sums = bincount(keys, weights * values, count * classes).reshape(count, classes)
+            majority = total.argmax(axis=1)
+            total = total[arange(count), majority]
+            tilevalues = sums[arange(count), majority] / maximum(total, 1e-300)
+
+        self._colors = raster.colors(tilevalues)
+        empty = (total == 0).nonzero()[0]
+        if len(empty) > 0:
+            self._colors[empty] = raster.colors_for(array(faces)[empty])
+
+    def __getitem__(self, face):
+        tile = self._tiles.get(face)
+        if tile is None:
+            return self.raster[face]
+        return tuple(self._colors[tile].tolist())
+
+    def colors_for(self, vectors):
+        tiles = [self._tiles.get(face, -1) for face in map(tuple, vectors.tolist())]
+        colors = self._colors[tiles]
+        missing = [i for i, tile in enumerate(tiles) if tile < 0]
+        if len(missing) > 0:
+            colors[missing] = self.raster.colors_for(vectors[missing])
+        return colors
@@ -0,0 +1,37 @@
+from numpy import array, float64
+
+import instrument
+
+# Base class for color providers
+#
+# A provider maps tiles, given by their locations on the unit sphere, to RGB
+# colors with components from 0 to 1. Subclasses implement __getitem__ for a
+# single location and may override colors_for with a vectorized version.
+class Provider(object):
+    name = None
+
+    def __getitem__(self, face):
+        raise NotImplementedError
+
+    # colors for an (N,3) array of locations, as an (N,3) array
+    def colors_for(self, vectors):
+        return array([self[tuple(v)] for v in vectors.tolist()], float64).reshape(-1, 3)
+
+    # provider to color a particular grid with, such as one sampling data at
+    # a resolution suited to the grid's scale
+    def forgrid(self, grid):
+        return self
+
+    # releases anything the provider holds, such as worker processes
+    def close(self):
+        pass
+
+# colors for a list of faces from any provider, as an (N,3) array, using the
+# batch interface where there is one
+def facecolors(provider, faces):
+    instrument.count('provider calls')
+    instrument.count('provider colors', len(faces))
+    with instrument.span('colors'):
+        if hasattr(provider, 'colors_for'):
+            return provider.colors_for(array(faces, float64).reshape(-1, 3))
+        return array([provider[face] for face in faces], float64).reshape(-1, 3)
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from threading import RLock
+
+from numpy import float32, zeros
+
+import base
+
+# Memoizing wrapper around a color provider
+#
+# Computed colors are stored in a compact (N,3) float32 array, each tile
+# having a slot found by its location, which identifies a tile across grid
+# sizes and runs. Once the memory budget (in bytes) is used up, the slots of
+# the least recently used tiles are reused. hits and misses count lookups.
+#
+# A single cache can be shared by every view coloring with its provider,
+# and by threads coloring grids in the background. Colors are computed
+# outside its lock, which is held only to look them up and store them, so
+# a thread coloring many tiles doesn't hold up the others; a tile missed by
+# two threads at once is colored by both.
+class Cache(base.Provider):
+    # approximate bytes used per cached tile: its color, location key and
+    # bookkeeping
+    entrybytes = 256
+
+    def __init__(self, provider, budget=64 * 2**20):
+        self.provider = provider
+        self.name = provider.name
+        self.budget = budget
+        self.capacity = max(1, budget // self.entrybytes)
+        self._forgrids = {}
+        self._lock = RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._colors = zeros((0, 3), float32)
+            # tile location -> slot, least recently used first
+            self._slots = OrderedDict()
+            self.hits, self.misses = 0, 0
+
+    # each of the provider's providers for particular grids gets its own cache
+    def forgrid(self, grid):
+        provider = self.provider.forgrid(grid)
+        if provider is self.provider:
+            return self
+        with self._lock:
+            if provider not in self._forgrids:
+                self._forgrids[provider] = Cache(provider, self.budget)
+            return self._forgrids[provider]
+
+    def close(self):
+        self.provider.close()
+        for cache in self._forgrids.itervalues():
+            cache.close()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _allocate(self):
+        if len(self._slots) >= self.capacity:
+            _, slot = self._slots.popitem(last=False)
+            return slot
+        slot = len(self._slots)
+        if slot >= len(self._colors):
+            grown = zeros((min(self.capacity, max(16, 2 * len(self._colors))), 3), float32)
+            grown[:len(self._colors)] = self._colors
+            self._colors = grown
+        return slot
+
+    def _store(self, face):
+        slot = self._slots.pop(face, None)
+        if slot is None:
+            slot = self._allocate()
+        self._slots[face] = slot
+        return slot
+
+    # the stored float32 color, hit or miss, so a tile's color doesn't change
+    # once it's cached
+    def __getitem__(self, face):
+        with self._lock:
+            slot = self._slots.pop(face, None)
+            if slot is not None:
+                self.hits += 1
+                self._slots[face] = slot
+                return tuple(self._colors[slot].tolist())
+            self.misses += 1
+
+        color = self.provider[face]
+        with self._lock:
+            slot = self._store(face)
+            self._colors[slot] = color
+            return tuple(self._colors[slot].tolist())
+
+    def colors_for(self, vectors):
+        faces = map(tuple, vectors.tolist())
+        colors = zeros((len(faces), 3))
+
+        with self._lock:
+            hits, slots, misses = [], [], []
+            for i, face in enumerate(faces):
+                slot = self._slots.pop(face, None)
+                if slot is None:
+                    misses.append(i)
+                else:
+                    self._slots[face] = slot
+                    hits.append(i)
+                    slots.append(slot)
+            colors[hits] = self._colors[slots]
+            self.hits += len(hits)
+            self.misses += len(misses)
+
+        if len(misses) > 0:
+            # rounded as stored, to match the colors of later hits
+            colors[misses] = base.facecolors(self.provider, [faces[i] for i in misses]).astype(float32)
+            with self._lock:
+                # anything beyond capacity would only evict this batch's own
+                # colors
+                kept = misses[-self.capacity:]
+                slots = [self._store(faces[i]) for i in kept]
+                self._colors[slots] = colors[kept]
+        return colors
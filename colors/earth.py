@@ -1,9 +1,14 @@
 from math import atan2, pi, sqrt
-from os.path import dirname, realpath
+from os import remove
+from os.path import dirname, exists, getsize, realpath, splitext
 
-from numpy import memmap
+import numpy
+from numpy import arange, memmap, zeros
 
-class Provider(object):
+from aggregate import Aggregate
+import base
+
+class Provider(base.Provider):
     name = u'Earth elevation'
 
     file = dirname(realpath(__file__)) + '/etopo.bin'
@@ -12,8 +17,69 @@ class Provider(object):
     lats = 180 * res + 1
     lons = 360 * res + 1
 
-    def __init__(self):
-        self.data = memmap(self.file, self.dtype, mode='r')
+    # number of downsampled levels in the pyramid, each halving the
+    # resolution of the one before
+    levels = 10
+
+    # level 0 samples the full raster, higher levels the mean elevation of
+    # their cells
+    #
+    # With aggregate set to one of the aggregate module's modes, providers for
+    # grids color each tile from all the cells within it, at a level a few
+    # times finer than the grid's tiles.
+    def __init__(self, level=0, aggregate=None):
+        self.level = level
+        self.aggregate = aggregate
+        self.parameters = {'level': level, 'aggregate': aggregate}
+        if aggregate is not None:
+            self.name = u'{} (tile {})'.format(self.name, aggregate)
+        if level == 0:
+            self.data = memmap(self.file, self.dtype, mode='r')
+        else:
+            self.data = memmap(self.levelfile(self.file, level), self.dtype, mode='r').reshape(-1, 3)
+        self._providers = {}
+        self._aggregates = {}
+
+    # file holding a level of the pyramid for a raster
+    @staticmethod
+    def levelfile(file, level):
+        return '{}.{}.bin'.format(splitext(file)[0], level)
+
+    # rows and columns of a level
+    @classmethod
+    def shape(cls, level):
+        return -(-cls.lats >> level), -(-cls.lons >> level)
+
+    # file holding the cell -> tile table of a level for full grids of a size
+    @staticmethod
+    def tablefile(file, level, size):
+        return '{}.{}.tiles.{}.npy'.format(splitext(file)[0], level, size)
+
+    def _atlevel(self, level):
+        if level == self.level and self.aggregate is None:
+            return self
+        if level not in self._providers:
+            self._providers[level] = self.__class__(level)
+        return self._providers[level]
+
+    # the coarsest level whose cells are no larger than the spacing of the
+    # grid's tiles
+    def forgrid(self, grid):
+        cell = pi/180 / self.res
+        level = 0
+        while (level < self.levels and cell * 2**(level + 1) <= grid.scale() and
+               exists(self.levelfile(self.file, level + 1))):
+            level += 1
+        if self.aggregate is None:
+            return self._atlevel(level)
+
+        if grid not in self._aggregates:
+            level = max(0, level - 2)
+            full = len(grid.faces) == 10 * 3**grid.size + 2
+            self._aggregates[grid] = Aggregate(
+                self._atlevel(level), grid, self.aggregate,
+                self.tablefile(self.file, level, grid.size) if full else None)
+        return self._aggregates[grid]
 
     def __del__(self):
         del self.data
@@ -31,14 +97,82 @@ class Provider(object):
         value = elevation/11000.0/2 + 0.5
         return (0, 0, value)
 
+    # _color for an array of elevations, as an (N,3) array
+    @staticmethod
+    def _colors(elevations):
+        snowline = 4500.0
+        elevations = elevations.astype(numpy.float64)
+        colors = numpy.zeros((len(elevations), 3))
+        snow = elevations >= snowline
+        land = ~snow & (elevations >= 0)
+        sea = ~snow & ~land
+        colors[snow] = ((elevations[snow] - snowline)/(8500.0 - snowline)/2 + 0.5)[:,None]
+        colors[land, 1] = elevations[land]/snowline/2 + 0.5
+        colors[sea, 2] = elevations[sea]/11000.0/2 + 0.5
+        return colors
+
     def __getitem__(self, face):
         x, z, y = face
         lat = atan2(z, sqrt(x*x + y*y)) * 180/pi
         lon = atan2(y, x) * 180/pi
-        index = int(lat * self.res + self.lats/2) * self.lons + int(lon * self.res + self.lons/2)
-        elevation = self.data[index]
+        row = int(lat * self.res + self.lats/2) >> self.level
+        column = int(lon * self.res + self.lons/2) >> self.level
+        index = row * self.shape(self.level)[1] + column
+        elevation = self.data[index] if self.level == 0 else self.data[index, 0]
         return self.__class__._color(elevation)
 
+    # raster rows and columns at the provider's level for an (N,3) array of
+    # locations
+    def cells(self, vectors):
+        x, z, y = vectors[:,0], vectors[:,1], vectors[:,2]
+        lat = numpy.arctan2(z, numpy.sqrt(x*x + y*y)) * 180/pi
+        lon = numpy.arctan2(y, x) * 180/pi
+        return ((lat * self.res + self.lats/2).astype(int) >> self.level,
+                (lon * self.res + self.lons/2).astype(int) >> self.level)
+
+    # locations of the centers of cells at the provider's level, as an (N,3)
+    # array
+    def centers(self, rows, columns):
+        size = 2**self.level
+        lat = numpy.radians(((rows + 0.5) * size - self.lats/2) / float(self.res))
+        lon = numpy.radians(((columns + 0.5) * size - self.lons/2) / float(self.res))
+        return numpy.column_stack((
+            numpy.cos(lat) * numpy.cos(lon), numpy.sin(lat), numpy.cos(lat) * numpy.sin(lon)))
+
+    # raster indices at the provider's level for an (N,3) array of locations
+    def _indices(self, vectors):
+        rows, columns = self.cells(vectors)
+        return rows * self.shape(self.level)[1] + columns
+
+    # mean (0), minimum (1) or maximum (2) elevation of each cell at the
+    # provider's level
+    def values(self, channel):
+        return self.data if self.level == 0 else self.data[:,channel]
+
+    # relative area of each cell at the provider's level, or of the cells
+    # given as indices into the flattened raster
+    def weights(self, cells=None):
+        rows, columns = self.shape(self.level)
+        if cells is not None:
+            lat = self.centers(cells // columns, zeros(len(cells)))[:,1]
+            return numpy.sqrt(1 - lat*lat)
+        lat = self.centers(arange(rows), zeros(rows))[:,1]
+        return numpy.repeat(numpy.sqrt(1 - lat*lat), columns)
+
+    # sea, land and snow
+    classcount = 3
+
+    @staticmethod
+    def classes(elevations):
+        return (elevations >= 0).astype(int) + (elevations >= 4500.0)
+
+    # colors for an array of elevations
+    def colors(self, elevations):
+        return self.__class__._colors(elevations)
+
+    def colors_for(self, vectors):
+        return self.colors(self.values(0)[self._indices(vectors)])
+
     # compile ETOPO xyz file, like:
     #
     #   lat, lon, elevation
@@ -47,17 +181,74 @@ class Provider(object):
     #
     # input file is ordered by latitude, 90 to -90, with latitudes -180 to 180
     # for each latitude
+    #
+    # The input is parsed in blocks of about blocksize bytes, written straight
+    # into the preallocated output, so memory use is bounded by the block size.
+    # progress, if given, is called with the bytes read so far and the input
+    # size after each block. The position reached is saved alongside the
+    # output, and an interrupted compile resumes from it unless restart is set.
     @classmethod
-    def compile(cls, xyzfile):
-        hs = []
+    def compile(cls, xyzfile, target=None, blocksize=64 * 2**20, progress=None, restart=False):
+        target = cls.file if target is None else target
+        progressfile = target + '.progress'
+        count = cls.lats * cls.lons
+
+        offset, written = 0, 0
+        if not restart and exists(progressfile) and exists(target):
+            with open(progressfile, 'r') as f:
+                offset, written = [int(n) for n in f.read().split()]
+        m = memmap(target, dtype=cls.dtype, mode='r+' if offset > 0 else 'w+', shape=(count,))
+
+        size = getsize(xyzfile)
         with open(xyzfile, 'r') as f:
+            f.seek(offset)
             while True:
-                line = f.readline()
-                if len(line) == 0:
+                # read whole lines only
+                block = f.read(blocksize) + f.readline()
+                if len(block) == 0:
                     break
-                _, _, h = line.split()
-                hs.append(float(h))
+                # values may be separated by whitespace or commas
+                hs = numpy.fromstring(block.replace(',', ' '), sep=' ').reshape(-1, 3)[:,2]
+                if written + len(hs) > count:
+                    raise ValueError('{} has more than {} points'.format(xyzfile, count))
+                m[written:written + len(hs)] = hs
+                m.flush()
+
+                offset, written = f.tell(), written + len(hs)
+                with open(progressfile, 'w') as p:
+                    p.write('{} {}\n'.format(offset, written))
+                if progress is not None:
+                    progress(offset, size)
 
-        m = memmap(cls.file, dtype=cls.dtype, mode='w+', shape=(len(hs),))
-        m[:] = hs[:]
         del m
+        if written != count:
+            raise ValueError('{} has {} of {} points'.format(xyzfile, written, count))
+        cls.pyramid(target, blocksize)
+        remove(progressfile)
+
+    # write the downsampled levels for a compiled raster
+    #
+    # Each cell of a level covers two by two cells of the level below,
+    # clamped at the last row and column, and holds their mean, minimum and
+    # maximum elevations as float triples. Levels are built a strip of rows
+    # of about blocksize bytes at a time.
+    @classmethod
+    def pyramid(cls, target=None, blocksize=64 * 2**20):
+        target = cls.file if target is None else target
+        source = memmap(target, cls.dtype, 'r', shape=cls.shape(0) + (1,))
+        for level in range(1, cls.levels + 1):
+            rows, columns = cls.shape(level)
+            m = memmap(cls.levelfile(target, level), cls.dtype, 'w+', shape=(rows, columns, 3))
+            channels = source.shape[2]
+            strip = max(1, blocksize // (4 * source.shape[1] * channels * numpy.dtype(cls.dtype).itemsize))
+            for row in range(0, rows, strip):
+                cells = numpy.asarray(source[2*row:2*(row + strip)], numpy.float64)
+                cells = numpy.pad(cells, ((0, len(cells) % 2), (0, source.shape[1] % 2), (0, 0)), 'edge')
+                cells = cells.reshape(len(cells)//2, 2, columns, 2, channels)
+                m[row:row + len(cells),:,0] = cells[...,0].mean(axis=(1, 3))
+                m[row:row + len(cells),:,1] = cells[...,channels//2].min(axis=(1, 3))
+                m[row:row + len(cells),:,2] = cells[...,channels - 1].max(axis=(1, 3))
+            m.flush()
+            del source
+            source = m
+        del source
@@ -1,5 +1,12 @@
-class Provider(object):
+from numpy import repeat
+
+import base
+
+class Provider(base.Provider):
     name = u'Grayscale gradient'
 
     def __getitem__(self, face):
         return tuple(3 * [0.5 + sum(face)/6.0])
+
+    def colors_for(self, vectors):
+        return repeat(0.5 + vectors.sum(axis=1)[:,None]/6.0, 3, axis=1)
@@ -0,0 +1,96 @@
+from importlib import import_module
+from multiprocessing import cpu_count, Pool
+from multiprocessing.sharedctypes import RawArray
+from threading import Lock
+
+import numpy
+
+import base
+
+# state of each worker process, set up by _initialize
+_provider, _vectors, _colors = None, None, None
+
+def _initialize(modulename, classname, parameters, vectors, colors):
+    global _provider, _vectors, _colors
+    _provider = getattr(import_module(modulename), classname)(**parameters)
+    _vectors = numpy.frombuffer(vectors).reshape(-1, 3)
+    _colors = numpy.frombuffer(colors).reshape(-1, 3)
+
+def _colorchunk((start, end)):
+    _colors[start:end] = base.facecolors(_provider, _vectors[start:end])
+
+# Wrapper evaluating a provider's colors across a pool of processes
+#
+# Batches larger than a chunk are split into chunks colored by separate
+# processes, which exchange locations and colors through shared memory
+# rather than pickling them. Each process makes its own copy of the
+# provider from its module and class names, passing it any constructor
+# arguments from the provider's parameters attribute.
+#
+# The pool is started by the first batch large enough to need it and kept
+# for later ones, along with its shared memory. It is only started again
+# for a batch that does not fit, with room for twice as many locations.
+# close stops it. Batches from different threads take turns with the pool,
+# since they share its memory.
+class Parallel(base.Provider):
+    def __init__(self, provider, workers=None, chunksize=16384):
+        self.provider = provider
+        self.name = provider.name
+        self.workers = workers if workers is not None else cpu_count()
+        self.chunksize = chunksize
+        self._forgrids = {}
+        self._pool = None
+        self._capacity = 0
+        self._lock = Lock()
+
+    def forgrid(self, grid):
+        provider = self.provider.forgrid(grid)
+        if provider is self.provider:
+            return self
+        with self._lock:
+            if provider not in self._forgrids:
+                self._forgrids[provider] = Parallel(provider, self.workers, self.chunksize)
+            return self._forgrids[provider]
+
+    def close(self):
+        with self._lock:
+            self._stop()
+            self._capacity = 0
+        for parallel in self._forgrids.itervalues():
+            parallel.close()
+
+    # stops this provider's own pool, leaving those for grids running
+    def _stop(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    # starts the pool, if it is not running with room for count locations
+    def _start(self, count):
+        if count <= self._capacity:
+            return
+        capacity = max(count, 2 * self._capacity)
+        self._stop()
+        self._capacity = capacity
+        self._vectors, self._colors = [RawArray('d', self._capacity * 3) for _ in range(2)]
+        cls = type(self.provider)
+        self._pool = Pool(self.workers, _initialize, (
+            cls.__module__, cls.__name__, getattr(self.provider, 'parameters', {}),
+            self._vectors, self._colors))
+
+    def __getitem__(self, face):
+        return self.provider[face]
+
+    def colors_for(self, vectors):
+        count = len(vectors)
+        if count <= self.chunksize or self.workers < 2:
+            return base.facecolors(self.provider, vectors)
+
+        with self._lock:
+            self._start(count)
+            numpy.frombuffer(self._vectors).reshape(-1, 3)[:count] = vectors
+            self._pool.map(_colorchunk, [
+                (start, min(start + self.chunksize, count))
+                for start in range(0, count, self.chunksize)])
+            return numpy.frombuffer(self._colors).reshape(-1, 3)[:count].copy()
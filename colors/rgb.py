@@ -1,5 +1,10 @@
-class Provider(object):
+import base
+
+class Provider(base.Provider):
     name = u'RGB color space'
 
     def __getitem__(self, face):
         return tuple([(c + 1)/2.0 for c in face])
+
+    def colors_for(self, vectors):
+        return (vectors + 1)/2.0
@@ -1,6 +1,8 @@
 from noise._simplex import noise3
 
-class Provider(object):
+import base
+
+class Provider(base.Provider):
     name = u'Simplex noise'
 
     def __getitem__(self, face):
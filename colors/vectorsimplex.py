@@ -0,0 +1,132 @@
+import numpy
+from numpy import array, floor, int8, intp, maximum, subtract, zeros
+
+import base
+from cache import Cache
+
+# gradients at simplex corners: the midpoints of a cube's edges
+_gradients = array([
+    (1, 1, 0), (-1, 1, 0), (1, -1, 0), (-1, -1, 0),
+    (1, 0, 1), (-1, 0, 1), (1, 0, -1), (-1, 0, -1),
+    (0, 1, 1), (0, -1, 1), (0, 1, -1), (0, -1, -1)], numpy.float64)
+_gx, _gy, _gz = [_gradients[:,axis].copy() for axis in range(3)]
+
+# skewing factors between simplex and cube space
+_skew = 1/3.0
+_unskew = 1/6.0
+
+# Simplex noise provider evaluating whole arrays of locations at once
+#
+# Noise is summed over octaves, each at lacunarity times the frequency and
+# persistence times the amplitude of the one before, like noise.snoise3.
+# Gradients are picked by a permutation of 256 drawn from the seed, so a
+# given seed colors tiles the same way in every run.
+#
+# With cache set, providers for grids cache their colors, one cache per grid
+# size.
+#
+# Locations are taken chunksize at a time, so that the temporary arrays of
+# each octave stay in the processor's cache.
+class Provider(base.Provider):
+    name = u'Simplex noise (vectorized)'
+    chunksize = 8192
+
+    def __init__(self, seed=0, octaves=8, persistence=0.75, lacunarity=10, cache=False):
+        self.parameters = {
+            'seed': seed,
+            'octaves': octaves,
+            'persistence': persistence,
+            'lacunarity': lacunarity,
+            'cache': cache}
+        self.octaves = octaves
+        self.persistence = persistence
+        self.lacunarity = lacunarity
+        permutation = numpy.random.RandomState(seed).permutation(256)
+        self._permutation = numpy.concatenate((permutation, permutation)).astype(intp)
+        # gradient components by hashed corner
+        self._gradients = [g[self._permutation % 12] for g in _gx, _gy, _gz]
+        self.cache = cache
+        self._caches = {}
+
+    def forgrid(self, grid):
+        if not self.cache:
+            return self
+        if grid.size not in self._caches:
+            self._caches[grid.size] = Cache(self)
+        return self._caches[grid.size]
+
+    # single octave of noise at arrays of coordinates, in [-1, 1]
+    def _noise(self, x, y, z):
+        p = self._permutation
+        gx, gy, gz = self._gradients
+        s = (x + y + z) * _skew
+        i, j, k = floor(x + s), floor(y + s), floor(z + s)
+        t = (i + j + k) * _unskew
+        x0, y0, z0 = x - i, y - j, z - k
+        x0 += t
+        y0 += t
+        z0 += t
+        i, j, k = [(c.astype(intp) & 255) for c in (i, j, k)]
+
+        # the simplex containing each point is found by the order of its
+        # offsets within its cell: its second corner steps along the
+        # largest, its third along all but the smallest
+        xy, yz, xz = x0 >= y0, y0 >= z0, x0 >= z0
+        rx = xy.astype(int8) + xz
+        ry = (~xy).astype(int8) + yz
+        rz = (~xz).astype(int8) + ~yz
+        steps = [(0, 0, 0), (rx == 2, ry == 2, rz == 2), (rx >= 1, ry >= 1, rz >= 1), (1, 1, 1)]
+
+        total = zeros(len(x))
+        for corner, (si, sj, sk) in enumerate(steps):
+            dx = x0 - si
+            dy = y0 - sj
+            dz = z0 - sk
+            dx += corner * _unskew
+            dy += corner * _unskew
+            dz += corner * _unskew
+            falloff = dx * dx
+            falloff += dy * dy
+            falloff += dz * dz
+            subtract(0.6, falloff, falloff)
+            maximum(falloff, 0, falloff)
+            falloff *= falloff
+            falloff *= falloff
+            h = i + si + p.take(j + sj + p.take(k + sk))
+            contribution = gx.take(h)
+            contribution *= dx
+            contribution += gy.take(h) * dy
+            contribution += gz.take(h) * dz
+            contribution *= falloff
+            total += contribution
+        total *= 32
+        return total
+
+    # noise summed over octaves for an (N,3) array of locations, in [-1, 1]
+    def elevations(self, vectors):
+        octaves = [(self.lacunarity ** n, self.persistence ** n) for n in range(self.octaves)]
+        total = zeros(len(vectors))
+        for start in range(0, len(vectors), self.chunksize):
+            chunk = vectors[start:start + self.chunksize]
+            for frequency, amplitude in octaves:
+                total[start:start + len(chunk)] += amplitude * self._noise(*(chunk * frequency).T)
+        return total / sum([amplitude for _, amplitude in octaves])
+
+    # colors for an array of elevations, as simplex.Provider colors them
+    @staticmethod
+    def colors(elevations):
+        snowline = 0.5
+        colors = zeros((len(elevations), 3))
+        snow = elevations >= snowline
+        land = ~snow & (elevations >= 0)
+        sea = ~snow & ~land
+        colors[snow] = ((elevations[snow] - snowline)/(1.0 - snowline)/2 + 0.5)[:,None]
+        colors[land, 1] = elevations[land]/snowline/2 + 0.5
+        colors[sea, 2] = elevations[sea]/2 + 0.5
+        return colors
+
+    def __getitem__(self, face):
+        return tuple(self.colors_for(array([face], numpy.float64))[0].tolist())
+
+    def colors_for(self, vectors):
+        return self.colors(self.elevations(vectors))
@@ -0,0 +1,393 @@
+from math import pi
+from os.path import exists, getsize, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from unittest import TestCase
+
+from numpy import arange, array, bincount, concatenate, memmap
+from numpy.random import RandomState
+
+from colors import base, gray, rgb, vectorsimplex
+from colors.aggregate import assign, modes, tilecells, Aggregate
+from colors.cache import Cache
+from colors.parallel import Parallel
+from grid import Grid
+
+class Lookup(base.Provider):
+    def __getitem__(self, face):
+        return (face[0], 0, 1)
+
+class ColorsTest(TestCase):
+    def setUp(self):
+        grid = Grid(Grid())
+        grid.populate()
+        self.faces = list(grid.faces)
+
+    def assertBatchMatches(self, provider):
+        batch = provider.colors_for(array(self.faces))
+        self.assertEqual((len(self.faces), 3), batch.shape)
+        for face, color in zip(self.faces, batch.tolist()):
+            for expected, actual in zip(provider[face], color):
+                self.assertAlmostEqual(expected, actual)
+
+    def test_default(self):
+        self.assertBatchMatches(Lookup())
+
+    def test_gray(self):
+        self.assertBatchMatches(gray.Provider())
+
+    def test_rgb(self):
+        self.assertBatchMatches(rgb.Provider())
+
+    def test_facecolors(self):
+        class Plain(object):
+            def __getitem__(self, face):
+                return (1, 0, 0)
+        for provider in Plain(), rgb.Provider():
+            self.assertEqual((len(self.faces), 3), base.facecolors(provider, self.faces).shape)
+
+    def test_earthcolors(self):
+        # earth colors are computed from elevations alone
+        from colors.earth import Provider
+        elevations = array([-11000, -10, 0, 10, 4499, 4500, 8500], 'float32')
+        for elevation, color in zip(elevations, Provider._colors(elevations).tolist()):
+            for expected, actual in zip(Provider._color(elevation), color):
+                self.assertAlmostEqual(expected, actual, 6)
+
+class CacheTest(TestCase):
+    def setUp(self):
+        grid = Grid(Grid())
+        grid.populate()
+        self.faces = list(grid.faces)
+
+    def test_getitem(self):
+        provider = rgb.Provider()
+        cache = Cache(provider)
+        for face in self.faces + self.faces:
+            for expected, actual in zip(provider[face], cache[face]):
+                self.assertAlmostEqual(expected, actual, 6)
+        self.assertEqual((len(self.faces), len(self.faces)), (cache.misses, cache.hits))
+
+    def test_batch(self):
+        provider = rgb.Provider()
+        cache = Cache(provider)
+        cache.colors_for(array(self.faces[:10]))
+        colors = cache.colors_for(array(self.faces))
+        self.assertTrue(abs(colors - provider.colors_for(array(self.faces))).max() < 1e-6)
+        self.assertEqual((len(self.faces), 10), (cache.misses, cache.hits))
+
+    def test_stable(self):
+        cache = Cache(rgb.Provider())
+        # a tile's color is the same on the miss that caches it as after
+        first = [cache[face] for face in self.faces]
+        self.assertEqual(first, [cache[face] for face in self.faces])
+        cache.clear()
+        colors = cache.colors_for(array(self.faces))
+        self.assertEqual(colors.tolist(), cache.colors_for(array(self.faces)).tolist())
+        self.assertEqual(first, map(tuple, colors.tolist()))
+
+    def test_eviction(self):
+        cache = Cache(rgb.Provider(), 10 * Cache.entrybytes)
+        colors = cache.colors_for(array(self.faces))
+        self.assertEqual(10, len(cache))
+        self.assertTrue(abs(colors - rgb.Provider().colors_for(array(self.faces))).max() < 1e-6)
+
+        # least recently used go first
+        cache[self.faces[-10]]
+        cache[self.faces[0]]
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(10, len(cache))
+        cache[self.faces[-10]]
+        self.assertEqual(2, cache.hits)
+        cache[self.faces[-9]]
+        self.assertEqual(2, cache.hits)
+
+    def test_unlocked(self):
+        faces = self.faces
+        # colors computed for one thread while another uses the cache
+        class Slow(base.Provider):
+            def __getitem__(self, face):
+                if face == faces[0]:
+                    thread = Thread(target=lambda: cache.colors_for(array(faces[1:])))
+                    thread.start()
+                    thread.join(10)
+                    self.blocked = thread.is_alive()
+                return rgb.Provider()[face]
+        provider = Slow()
+        cache = Cache(provider)
+        cache[faces[0]]
+        self.assertFalse(provider.blocked)
+        self.assertEqual(len(faces), len(cache))
+
+class ParallelTest(TestCase):
+    def setUp(self):
+        grid = Grid()
+        for _ in range(2):
+            grid = Grid(grid)
+            grid.populate()
+        self.vectors = array(list(grid.faces))
+
+    def test_chunks(self):
+        parallel = Parallel(Lookup(), workers=2, chunksize=20)
+        expected = Lookup().colors_for(self.vectors)
+        try:
+            self.assertEqual(expected.tolist(), parallel.colors_for(self.vectors).tolist())
+        finally:
+            parallel.close()
+
+    def test_pool(self):
+        parallel = Parallel(Lookup(), workers=2, chunksize=20)
+        expected = Lookup().colors_for(self.vectors)
+        try:
+            parallel.colors_for(self.vectors)
+            pool = parallel._pool
+            # smaller batches reuse the pool, larger ones replace it
+            self.assertEqual(expected[:50].tolist(), parallel.colors_for(self.vectors[:50]).tolist())
+            self.assertIs(pool, parallel._pool)
+            doubled = concatenate((self.vectors, self.vectors))
+            self.assertEqual(
+                concatenate((expected, expected)).tolist(),
+                parallel.colors_for(doubled).tolist())
+            self.assertIsNot(pool, parallel._pool)
+            # with room for twice as many as before
+            parallel.colors_for(concatenate((doubled, self.vectors[:1])))
+            self.assertEqual(4 * len(self.vectors), parallel._capacity)
+        finally:
+            parallel.close()
+        self.assertIsNone(parallel._pool)
+
+    def test_forgrid(self):
+        parallel = Parallel(Lookup(), workers=2, chunksize=20)
+        child = Parallel(Lookup(), workers=2, chunksize=20)
+        parallel._forgrids[Lookup()] = child
+        try:
+            child.colors_for(self.vectors)
+            parallel.colors_for(self.vectors)
+            # growing the pool leaves those for grids running
+            parallel.colors_for(concatenate((self.vectors, self.vectors)))
+            self.assertIsNotNone(child._pool)
+        finally:
+            parallel.close()
+        self.assertIsNone(child._pool)
+
+    def test_small(self):
+        parallel = Parallel(rgb.Provider(), workers=2)
+        self.assertEqual(rgb.Provider()[(1, 0, 0)], parallel[(1, 0, 0)])
+        expected = rgb.Provider().colors_for(self.vectors)
+        self.assertEqual(expected.tolist(), parallel.colors_for(self.vectors).tolist())
+
+class CompileTest(TestCase):
+    def setUp(self):
+        from colors.earth import Provider
+        self.directory = mkdtemp()
+        class Small(Provider):
+            lats, lons = 3, 5
+            levels = 2
+            file = join(self.directory, 'etopo.bin')
+        self.provider = Small
+        self.xyzfile = join(self.directory, 'etopo.xyz')
+        self.target = Small.file
+        self.heights = range(-7, 8)
+        with open(self.xyzfile, 'w') as f:
+            for i, h in enumerate(self.heights):
+                f.write('{} {} {}\n'.format(90 - 90 * (i // 5), -180 + 90 * (i % 5), h))
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def compiled(self):
+        return memmap(self.target, 'float32', 'r').tolist()
+
+    def test_compile(self):
+        reports = []
+        self.provider.compile(self.xyzfile, self.target, 20, lambda *args: reports.append(args))
+        self.assertEqual(self.heights, self.compiled())
+        self.assertEqual((getsize(self.xyzfile),) * 2, reports[-1])
+        self.assertTrue(len(reports) > 1)
+        self.assertFalse(exists(self.target + '.progress'))
+
+    def test_resume(self):
+        def interrupt(done, size):
+            raise KeyboardInterrupt
+        self.assertRaises(KeyboardInterrupt,
+            self.provider.compile, self.xyzfile, self.target, 20, interrupt)
+        self.assertTrue(exists(self.target + '.progress'))
+
+        reports = []
+        self.provider.compile(self.xyzfile, self.target, 20, lambda *args: reports.append(args))
+        self.assertEqual(self.heights, self.compiled())
+        self.assertTrue(reports[0][0] > 20)
+
+    def test_commas(self):
+        with open(self.xyzfile, 'w') as f:
+            for i, h in enumerate(self.heights):
+                f.write('{}, {}, {}\n'.format(90 - 90 * (i // 5), -180 + 90 * (i % 5), h))
+        self.provider.compile(self.xyzfile, self.target, 20)
+        self.assertEqual(self.heights, self.compiled())
+
+    def test_short(self):
+        with open(self.xyzfile, 'w') as f:
+            f.write('90 -180 1\n')
+        self.assertRaises(ValueError, self.provider.compile, self.xyzfile, self.target)
+
+    def test_pyramid(self):
+        self.provider.compile(self.xyzfile, self.target)
+        level = memmap(self.provider.levelfile(self.target, 1), 'float32', 'r').reshape(2, 3, 3)
+        self.assertEqual([-4, -7, -1], level[0,0].tolist())
+        self.assertEqual([-0.5, -3, 2], level[0,2].tolist())
+        self.assertEqual([7, 7, 7], level[1,2].tolist())
+        level = memmap(self.provider.levelfile(self.target, 2), 'float32', 'r').reshape(1, 2, 3)
+        self.assertEqual([-7, 6], level[0,0,1:].tolist())
+
+    def test_forgrid(self):
+        self.provider.compile(self.xyzfile, self.target)
+        class Scaled(object):
+            def __init__(self, cells):
+                self.cells = cells
+            def scale(self):
+                return self.cells * pi/180/60
+        provider = self.provider()
+        self.assertIs(provider, provider.forgrid(Scaled(1.5)))
+        coarse = provider.forgrid(Scaled(2.5))
+        self.assertEqual(1, coarse.level)
+        self.assertIs(coarse, provider.forgrid(Scaled(3)))
+        self.assertEqual(2, provider.forgrid(Scaled(100)).level)
+
+        self.assertEqual(self.provider._color(0), provider[(1, 0, 0)])
+        self.assertEqual(self.provider._color(-2), coarse[(1, 0, 0)])
+        self.assertEqual([list(self.provider._color(-2))], coarse.colors_for(array([(1., 0, 0)])).tolist())
+
+        cache = Cache(provider)
+        self.assertIs(cache.forgrid(Scaled(2.5)), cache.forgrid(Scaled(3)))
+        self.assertIs(coarse, cache.forgrid(Scaled(2.5)).provider)
+
+class AggregateTest(TestCase):
+    def setUp(self):
+        from colors.earth import Provider
+        self.directory = mkdtemp()
+        class Coarse(Provider):
+            res = 1
+            lats, lons = 181, 361
+            levels = 0
+            file = join(self.directory, 'etopo.bin')
+        self.provider = Coarse
+        # elevations rising from south to north, crossing the shore and the
+        # snowline
+        rows = arange(Coarse.lats).repeat(Coarse.lons)
+        memmap(Coarse.file, 'float32', 'w+', shape=rows.shape)[:] = 100 * (rows - 90)
+
+        self.grid = Grid()
+        for _ in range(2):
+            self.grid = Grid(self.grid)
+            self.grid.populate()
+        self.faces = sorted(self.grid.faces)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_assign(self):
+        table = assign(self.grid, self.provider())
+        self.assertTrue((table >= 0).all())
+        self.assertEqual(range(len(self.faces)), sorted(set(table.tolist())))
+
+    def test_partial(self):
+        provider = self.provider()
+        full = Grid(self.grid)
+        full.populate()
+        table = assign(full, provider)
+        fullfaces = sorted(full.faces)
+        grid = Grid(self.grid)
+        grid.populate(self.faces[0])
+        faces = sorted(grid.faces)
+        cells, tiles = tilecells(grid.faces, provider)
+        # only cells near the tiles are assigned, as they are in a full grid
+        self.assertTrue(len(cells) < len(table) / 4)
+        for tile, face in enumerate(faces):
+            expected = set((table == fullfaces.index(face)).nonzero()[0].tolist())
+            self.assertTrue(expected <= set(cells[tiles == tile].tolist()))
+
+    def test_modes(self):
+        provider = self.provider()
+        table = assign(self.grid, provider)
+        elevations = provider.values(0)
+        weights = provider.weights()
+        tilecolors = dict((mode, Aggregate(provider, self.grid, mode).colors_for(array(self.faces)))
+                          for mode in modes)
+        for tile in range(len(self.faces)):
+            cells = table == tile
+            values = elevations[cells].astype(float)
+            mean = (values * weights[cells]).sum() / weights[cells].sum()
+            for mode, value in ('mean', mean), ('min', values.min()), ('max', values.max()):
+                for expected, actual in zip(self.provider._color(value), tilecolors[mode][tile]):
+                    self.assertAlmostEqual(expected, actual)
+            classes = self.provider.classes(values)
+            majority = classes == bincount(classes, weights[cells]).argmax()
+            value = (values * weights[cells])[majority].sum() / weights[cells][majority].sum()
+            for expected, actual in zip(self.provider._color(value), tilecolors['majority'][tile]):
+                self.assertAlmostEqual(expected, actual)
+
+    def test_forgrid(self):
+        provider = self.provider(aggregate='max')
+        aggregate = provider.forgrid(self.grid)
+        self.assertIs(aggregate, provider.forgrid(self.grid))
+        tablefile = provider.tablefile(provider.file, 0, self.grid.size)
+        self.assertTrue(exists(tablefile))
+
+        # a new provider loads the saved table
+        again = self.provider(aggregate='max').forgrid(self.grid)
+        self.assertEqual(aggregate.colors_for(array(self.faces)).tolist(),
+                         again.colors_for(array(self.faces)).tolist())
+
+        # tiles unknown to the table are colored from their centers
+        self.assertNotIn((1, 0, 0), self.grid.faces)
+        self.assertEqual(self.provider()[(1, 0, 0)], aggregate[(1, 0, 0)])
+
+class VectorSimplexTest(TestCase):
+    def setUp(self):
+        grid = Grid()
+        for _ in range(3):
+            grid = Grid(grid)
+            grid.populate()
+        self.grid = grid
+        self.vectors = array(sorted(grid.faces))
+
+    def test_batch(self):
+        provider = vectorsimplex.Provider()
+        colors = provider.colors_for(self.vectors)
+        self.assertEqual(self.vectors.shape, colors.shape)
+        self.assertTrue(((colors >= 0) & (colors <= 1)).all())
+        for vector, color in zip(self.vectors[:20], colors):
+            self.assertEqual(tuple(color.tolist()), provider[tuple(vector)])
+
+    def test_noise(self):
+        # values spread across the range, and vary smoothly
+        points = RandomState(1).uniform(-10, 10, (10000, 3))
+        values = vectorsimplex.Provider()._noise(*points.T)
+        self.assertTrue(abs(values).max() <= 1)
+        self.assertTrue(abs(values).max() > 0.5)
+        nearby = vectorsimplex.Provider()._noise(*(points + 1e-6).T)
+        self.assertTrue(abs(values - nearby).max() < 1e-4)
+
+    def test_seed(self):
+        elevations = [vectorsimplex.Provider(seed).elevations(self.vectors) for seed in 0, 0, 1]
+        self.assertEqual(elevations[0].tolist(), elevations[1].tolist())
+        self.assertNotEqual(elevations[0].tolist(), elevations[2].tolist())
+
+    def test_octaves(self):
+        one = vectorsimplex.Provider(octaves=1)
+        self.assertEqual(one._noise(*self.vectors.T).tolist(), one.elevations(self.vectors).tolist())
+        two = vectorsimplex.Provider(octaves=2, persistence=0.5, lacunarity=2)
+        expected = (one._noise(*self.vectors.T) + 0.5 * one._noise(*(2 * self.vectors).T)) / 1.5
+        self.assertTrue(abs(expected - two.elevations(self.vectors)).max() < 1e-12)
+
+    def test_cache(self):
+        provider = vectorsimplex.Provider()
+        self.assertIs(provider, provider.forgrid(self.grid))
+        provider = vectorsimplex.Provider(cache=True)
+        cache = provider.forgrid(self.grid)
+        self.assertIs(cache, provider.forgrid(self.grid))
+        self.assertIsNot(cache, provider.forgrid(self.grid.prev))
+        cache.colors_for(self.vectors)
+        cache.colors_for(self.vectors)
+        self.assertEqual(len(self.vectors), cache.hits)
@@ -0,0 +1,85 @@
+from numpy import arange, array, float32, newaxis, sqrt, uint32, zeros
+
+from colors.base import facecolors
+
+# number of vertices and triangles stored per tile: its center and up to six
+# corners, fanned into up to six triangles
+tilevertices = 7
+tiletriangles = 6
+
+# interleaved floats per vertex: position, normal and color
+stride = 9
+
+# Packs tiles into arrays for drawing with glDrawElements
+#
+# Each tile is a fan of triangles around its center, with its own copies of
+# its corners so it can be flat-shaded and colored: all of a tile's vertices
+# share the normal at its center and the provider's color for the tile.
+#
+# Returns an (N * 7, 9) float32 array of interleaved vertex positions, normals
+# and colors, and an (N * 18,) uint32 array of triangle vertex indices into
+# it, numbered from tile slot first on. Every tile takes the same number of
+# slots, pentagons' being padded with degenerate vertices and triangles, so
+# tiles can be written anywhere in preallocated buffers.
+def tilegeometry(faces, corners, colors, first=0):
+    count = len(faces)
+    data = zeros((count, tilevertices, stride), float32)
+    if count == 0:
+        return data.reshape(0, stride), zeros(0, uint32)
+
+    centers = array(faces, float32)
+    degrees = array([len(vs) for vs in corners])
+    data[:,0,0:3] = centers
+    data[:,1:,0:3] = array([vs + vs[:1] * (tiletriangles - len(vs)) for vs in corners], float32)
+    data[:,:,3:6] = (centers / sqrt((centers * centers).sum(axis=1))[:,newaxis])[:,newaxis,:]
+    data[:,:,6:9] = facecolors(colors, faces)[:,newaxis,:]
+
+    # triangle i of a tile joins its center to corners i and i + 1
+    corner = arange(tiletriangles)
+    following = (corner[newaxis,:] + 1) % degrees[:,newaxis]
+    triangles = zeros((count, tiletriangles, 3), uint32)
+    triangles[:,:,1] = 1 + corner
+    triangles[:,:,2] = 1 + following
+    triangles[corner[newaxis,:] >= degrees[:,newaxis]] = 0
+    triangles += (tilevertices * arange(first, first + count, dtype=uint32))[:,newaxis,newaxis]
+
+    return data.reshape(count * tilevertices, stride), triangles.reshape(-1)
+
+# Packs all of a grid's tiles, see tilegeometry
+def gridgeometry(grid, colors):
+    faces = list(grid.faces)
+    return tilegeometry(faces, [grid.faces[face] for face in faces], colors)
+
+# Tile arrays for a grid, grown as the grid is populated
+#
+# Tiles are appended in fixed-size slots to arrays with spare capacity,
+# which double when full, so adding tiles costs time proportional to the
+# tiles added.
+class TileArrays(object):
+    def __init__(self, capacity=12):
+        self.count = 0
+        self.vertices = zeros((capacity * tilevertices, stride), float32)
+        self.indices = zeros(capacity * tiletriangles * 3, uint32)
+
+    @property
+    def capacity(self):
+        return len(self.vertices) // tilevertices
+
+    # Appends tiles, see tilegeometry
+    #
+    # Returns the first slot written and whether the arrays were replaced
+    # with larger ones.
+    def extend(self, faces, corners, colors):
+        first, self.count = self.count, self.count + len(faces)
+        grown = self.count > self.capacity
+        if grown:
+            capacity = max(self.count, 2 * self.capacity)
+            vertices = zeros((capacity * tilevertices, stride), float32)
+            indices = zeros(capacity * tiletriangles * 3, uint32)
+            vertices[:len(self.vertices)] = self.vertices
+            indices[:len(self.indices)] = self.indices
+            self.vertices, self.indices = vertices, indices
+        vertices, indices = tilegeometry(faces, corners, colors, first)
+        self.vertices[first * tilevertices:self.count * tilevertices] = vertices
+        self.indices[first * tiletriangles * 3:self.count * tiletriangles * 3] = indices
+        return first, grown
@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+from colors import rgb
+from geometry import gridgeometry, stride, tilegeometry, tiletriangles, tilevertices, TileArrays
+from grid import Grid
+
+class GeometryTest(TestCase):
+    def test_dodecahedron(self):
+        grid = Grid()
+        vertices, indices = gridgeometry(grid, rgb.Provider())
+        self.assertEqual((12 * tilevertices, stride), vertices.shape)
+        self.assertEqual(12 * tiletriangles * 3, len(indices))
+
+    def test_tiles(self):
+        grid = Grid(Grid())
+        grid.populate()
+        colors = rgb.Provider()
+        faces = list(grid.faces)
+        vertices, indices = gridgeometry(grid, colors)
+        self.assertEqual(32 * tiletriangles * 3, len(indices))
+        for i, face in enumerate(faces):
+            tile = vertices[i * tilevertices:(i + 1) * tilevertices]
+            for j, corner in enumerate(grid.faces[face]):
+                for k in range(3):
+                    self.assertAlmostEqual(corner[k], tile[j + 1][k], 6)
+            for k in range(3):
+                self.assertAlmostEqual(face[k], tile[0][k], 6)
+                self.assertAlmostEqual(colors[face][k], tile[0][6 + k], 6)
+
+    def test_winding(self):
+        grid = Grid(Grid())
+        grid.populate()
+        vertices, indices = gridgeometry(grid, rgb.Provider())
+        for a, b, c in indices.reshape(-1, 3):
+            if a == b:
+                # pentagon padding
+                continue
+            pa, pb, pc = [vertices[i][0:3] for i in a, b, c]
+            u, v = pb - pa, pc - pa
+            cross = [u[1]*v[2] - u[2]*v[1], u[2]*v[0] - u[0]*v[2], u[0]*v[1] - u[1]*v[0]]
+            self.assertGreater(sum([cross[i] * pa[i] for i in range(3)]), 0)
+
+    def test_tilearrays(self):
+        grid = Grid(Grid(Grid()))
+        colors = rgb.Provider()
+        tiles = TileArrays()
+        changes = 0
+        for face in grid.prev.prev.faces.keys()[0:4]:
+            grid.populate(face)
+            faces, changes = grid.changes(changes)
+            tiles.extend(faces, [grid.faces[f] for f in faces], colors)
+        self.assertEqual(len(grid.faces), tiles.count)
+        self.assertGreaterEqual(tiles.capacity, tiles.count)
+
+        faces, _ = grid.changes()
+        vertices, indices = tilegeometry(faces, [grid.faces[f] for f in faces], colors)
+        self.assertTrue((vertices == tiles.vertices[:len(vertices)]).all())
+        self.assertTrue((indices == tiles.indices[:len(indices)]).all())
@@ -1,4 +1,13 @@
+import gc
 import math
+from collections import OrderedDict
+from heapq import heappop, heappush
+from itertools import count, izip
+
+from numpy import (arange, argsort, array, bincount, empty, full, int32, int64, lexsort,
+                   minimum, searchsorted, sort, sqrt, unique, where, zeros)
+
+import instrument
 
 def squared_length(v):
     return sum([vi * vi for vi in v])
@@ -19,6 +28,53 @@ def cross(v1, v2):
 def dot(v1, v2):
     return sum([v1[i] * v2[i] for i in range(3)])
 
+# Vertex of the next size within a face, by the edge between two of its
+# vertices
+#
+# The vertices are added first: floating-point addition is commutative, so
+# this gives the same bits whichever order the edge's vertices come in, and
+# every tile meeting at the new vertex, each finding it from its own side,
+# gets the same location for it.
+def corner(face, v1, v2):
+    return normal([face[i] + (v1[i] + v2[i]) for i in range(3)])
+
+# edges of a polygon as sorted vertex pairs, in order
+def polygonedges(vertices):
+    return [tuple(sorted(vs)) for vs in zip(vertices, vertices[1:] + vertices[0:1])]
+
+# Array counterparts of the above for (N,3) arrays of vectors, performing
+# the same floating-point operations in the same order so results are
+# bit-identical to the tuple versions
+
+def _normals(vs):
+    d = 1.0 / sqrt(vs[:,0] * vs[:,0] + vs[:,1] * vs[:,1] + vs[:,2] * vs[:,2])
+    return vs * d[:,None]
+
+def _crosses(v1, v2):
+    return array([
+        v1[:,1]*v2[:,2] - v1[:,2]*v2[:,1],
+        v1[:,2]*v2[:,0] - v1[:,0]*v2[:,2],
+        v1[:,0]*v2[:,1] - v1[:,1]*v2[:,0]]).T
+
+def _dots(v1, v2):
+    return v1[:,0]*v2[:,0] + v1[:,1]*v2[:,1] + v1[:,2]*v2[:,2]
+
+# size 0 faces, and the neighbors of each as indices into the same list
+_x = -0.525731112119133606
+_z = -0.850650808352039932
+
+dodecfaces = [
+        (-_x, 0, _z), (_x, 0, _z), (-_x, 0, -_z), (_x, 0, -_z),
+        (0, _z, _x), (0, _z, -_x), (0, -_z, _x), (0, -_z, -_x),
+        (_z, _x, 0), (-_z, _x, 0), (_z, -_x, 0), (-_z, -_x, 0)
+]
+
+dodecneighbors = [
+        (9, 4, 1, 6, 11), (4, 8, 10, 6, 0), (11, 7, 3, 5, 9), (2, 7, 10, 8, 5),
+        (9, 5, 8, 1, 0), (2, 3, 8, 4, 9), (0, 1, 10, 7, 11), (11, 6, 10, 3, 2),
+        (5, 3, 10, 1, 4), (2, 5, 4, 0, 11), (3, 7, 6, 1, 8), (7, 2, 9, 0, 6)
+]
+
 # A spherical "grid" divided into hex/pentagons
 #
 # A size 0 grid is a dodecahedron, and each subsequent size is the result
@@ -49,34 +105,285 @@ def dot(v1, v2):
 # 5- or 6-length vertex list, and the other mapping vertices to each vertex's
 # set of adjacent faces (3 of them if the faces are all defined at that size).
 # All locations are vectors on the unit sphere.
+#
+# An edge index is kept alongside them, holding each face's edges and
+# neighbors in order and the faces on either side of each edge, so that
+# walking the grid never needs to intersect vertex sets.
+#
+# Every face also has an integer address relating it to the faces of other
+# sizes, in the spirit of H3 or S2 cell IDs. A size 0 face's address is its
+# index in dodecfaces, and each subsequent size appends three bits for the
+# face's place among its parent's children: a face carried over from the
+# previous size is child 0 of itself, and a face made from a previous vertex
+# is a child of the vertex's face with the lowest address, numbered 1 + the
+# vertex's rank among that face's sorted vertices. Parents, children and
+# ancestors are then found by shifting addresses.
+#
+# Faces and vertices are keyed by their locations throughout, rather than by
+# integer IDs: each location is computed the same way from every tile that
+# shares it (see corner), so keys match exactly at any size, and addresses
+# serve where an integer identity is wanted.
+#
+# Faces are also appended to a log as they are added, which views use to
+# catch up on what populate has added since they last looked (see changes).
+#
+# A lazily populated grid can be given a budget of tiles. Once populating
+# takes it over budget, the tiles subdivided from the least recently
+# populated faces of the previous size are evicted, down to three quarters
+# of the budget, sparing those the next size still needs. Evicted tiles are
+# populated again, identically, when they are next asked for.
+#
+# A grid made with link unset leaves the previous size untouched until link
+# is called, so that it can be built on another thread.
 class Grid(object):
-    def __init__(self, prev=None):
+    def __init__(self, prev=None, budget=None, link=True):
         self.prev = prev
         self.size = self.prev.size + 1 if self.prev is not None else 0
-        self.faces = {}
-        self.vertices = {}
+        self._journal = []
+        self._initstorage()
 
-        if self.prev is None:
-            x = -0.525731112119133606
-            z = -0.850650808352039932
+        self.budget = budget
+        self.evictions = 0
+        # previous faces subdivided, least recently populated first
+        self._recent = OrderedDict() if budget is not None else None
+        # the next size, and the number of its tiles needing each of this
+        # size's, along with pins, which are spared from eviction
+        self._next = None
+        self._holds = {}
+        if self.prev is not None and link:
+            self.link()
 
-            dodecfaces = [
-                    (-x, 0, z), (x, 0, z), (-x, 0, -z), (x, 0, -z),
-                    (0, z, x), (0, z, -x), (0, -z, x), (0, -z, -x),
-                    (z, x, 0), (-z, x, 0), (z, -x, 0), (-z, -x, 0)
-            ]
-
-            dodecneighbors = [
-                    (9, 4, 1, 6, 11), (4, 8, 10, 6, 0), (11, 7, 3, 5, 9), (2, 7, 10, 8, 5),
-                    (9, 5, 8, 1, 0), (2, 3, 8, 4, 9), (0, 1, 10, 7, 11), (11, 6, 10, 3, 2),
-                    (5, 3, 10, 1, 4), (2, 5, 4, 0, 11), (3, 7, 6, 1, 8), (7, 2, 9, 0, 6)
-            ]
+        self._addresses = {}
+        self._addressfaces = {}
+        self._scale = None
 
+        if self.prev is None and len(self.faces) == 0:
             for i in range(len(dodecfaces)):
                 self._makeface(
                     dodecfaces[i],
                     [dodecfaces[n] for n in dodecneighbors[i]])
 
+    # makes this grid the next size of the previous one, which then keeps
+    # the tiles this one's were subdivided from
+    def link(self):
+        other = self.prev._next
+        if other is not None and other is not self:
+            other._hold(other.faces, -1)
+        self.prev._next = self
+        self._hold(self.faces, 1)
+
+    # counts faces of this size, n times each, against the eviction of the
+    # previous size's tiles they were subdivided from: their own and those
+    # around its vertices
+    def _hold(self, faces, n):
+        prev = self.prev
+        if prev is None or prev.budget is None or prev._next is not self:
+            return
+        for face in faces:
+            if face not in prev.faces:
+                continue
+            held = [face]
+            for vertex in prev.faces[face]:
+                held.extend(prev.vertices[vertex])
+            prev._count(held, n)
+
+    def _count(self, faces, n):
+        holds = self._holds
+        for face in faces:
+            count = holds.get(face, 0) + n
+            if count == 0:
+                del holds[face]
+            else:
+                holds[face] = count
+
+    # Spares tiles from eviction until unpinned
+    #
+    # Pins are counted, so faces pinned by several users, such as the
+    # detail view and the walk ahead of it, stay until each has unpinned
+    # them. Faces are pinned whether or not they are populated yet.
+    def pin(self, faces):
+        self._count(faces, 1)
+
+    def unpin(self, faces):
+        self._count(faces, -1)
+
+    # storage hooks, overridden by alternate backends (see arraygrid)
+    def _initstorage(self):
+        self.faces = {}
+        self.vertices = {}
+        self._faceedges = {}
+        self._edgefaces = {}
+        self._neighbors = {}
+
+    def _setface(self, face, vertices):
+        if face not in self.faces:
+            self._journal.append(face)
+            instrument.count('faces populated')
+            self._hold([face], 1)
+        self.faces[face] = vertices
+        self._addface(face)
+        self._indexface(face)
+
+    # stores a whole size at once: faces is a list of face locations,
+    # vertices a list of vertex locations, and table an (N,6) array of
+    # indices into vertices for each face, padded with -1. progress, if
+    # given, is called with the number of faces stored so far every so often
+    def _setlevel(self, faces, vertices, table, progress=None):
+        if len(self.faces) == 0:
+            self._storelevel(faces, vertices, table, progress)
+            return
+        for i, (face, row) in enumerate(izip(faces, table.tolist())):
+            if progress is not None and i % 4096 == 0:
+                progress(i)
+            self._setface(face, [vertices[v] for v in row if v >= 0])
+
+    # Stores a whole size in an empty grid, as _setface would a face at a
+    # time
+    #
+    # The faces around each vertex and on each edge are found from the
+    # table first, for every face at once. Faces are then stored a few
+    # thousand at a time, indexed as they are, each batch giving the faces
+    # stored before it their neighbors among its own, so an abandoned grid
+    # is left consistent. Lists are made a batch at a time rather than a
+    # face at a time, and without collecting garbage meanwhile: none of
+    # them refer back to each other, and each collection would walk every
+    # tile of every size.
+    def _storelevel(self, faces, vertices, table, progress=None):
+        n = len(faces)
+        valid = table >= 0
+        degrees = valid.sum(axis=1)
+        # places: each face's vertices and the edges after them, in order
+        fs, ks = valid.nonzero()
+        places = full(table.shape, -1, int64)
+        places[fs, ks] = arange(len(fs))
+        v1 = table[fs, ks]
+        v2 = table[fs, (ks + 1) % degrees[fs]]
+
+        # each vertex's faces in order, padded with n, and the place it is
+        # first found
+        order = lexsort((fs, v1))
+        ranks = arange(len(fs)) - searchsorted(v1[order], v1[order])
+        vertexfaces = full((len(vertices), 3), n, int64)
+        vertexfaces[v1[order], ranks] = fs[order]
+        firstplaces = zeros(len(vertices), int64)
+        firstplaces[v1[order][ranks == 0]] = order[ranks == 0]
+
+        # each edge's vertices in the order their locations sort in
+        ranks = zeros(len(vertices), int)
+        ranks[lexsort(array(vertices).T[::-1])] = arange(len(vertices))
+        first = ranks[v1] < ranks[v2]
+        keys = where(first, v1, v2).astype(int64) * len(vertices) + where(first, v2, v1)
+        keys, edgeids = unique(keys, return_inverse=True)
+
+        # the first place each edge is found and the second, or -1, and the
+        # face across each place's edge, or n
+        order = argsort(edgeids, kind='mergesort')
+        starts = searchsorted(edgeids[order], arange(len(keys)))
+        firsts = order[starts]
+        seconds = where(bincount(edgeids, minlength=len(keys)) < 2, -1,
+                        order[minimum(starts + 1, len(order) - 1)])
+        across = where(arange(len(fs)) == firsts[edgeids], seconds[edgeids], firsts[edgeids])
+        others = where(across >= 0, fs[across], n)
+        firstfaces, secondfaces = fs[firsts], where(seconds >= 0, fs[seconds], n)
+
+        edges = zip(map(vertices.__getitem__, (keys // len(vertices)).tolist()),
+                    map(vertices.__getitem__, (keys % len(vertices)).tolist()))
+        faces = faces + [None]
+        getface, getvertex, getedge = faces.__getitem__, vertices.__getitem__, edges.__getitem__
+        hexes = degrees == 6
+
+        facevertices = map(getvertex, v1.tolist())
+        faceedges = map(getedge, edgeids.tolist())
+
+        # (face, list) pairs for the faces from s to e in order, from values
+        # for each of their places in turn
+        def perface(s, e, values):
+            a = places[s, 0]
+            row = map(values.__getitem__, (places[s:e][hexes[s:e]] - a).ravel().tolist())
+            lists = map(list, izip(*[iter(row)] * 6))
+            for f in arange(s, e)[~hexes[s:e]].tolist():
+                lists.insert(f - s, values[places[f, 0] - a:places[f, 0] - a + degrees[f]])
+            return zip(faces[s:e], lists)
+
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for s in range(0, n, 4096):
+                if progress is not None:
+                    progress(s)
+                e = min(s + 4096, n)
+                a, b = places[s, 0], places[e - 1, 0] + degrees[e - 1]
+                batch = faces[s:e]
+
+                self._journal.extend(batch)
+                self.faces.update(perface(s, e, facevertices[a:b]))
+
+                # vertices first found in this batch, in the order they are
+                # found, then those found before with more faces in it
+                before, upto = (vertexfaces < s).sum(axis=1), (vertexfaces < e).sum(axis=1)
+                found = ((before == 0) & (upto > 0)).nonzero()[0]
+                found = found[argsort(firstplaces[found])]
+                sets = empty(len(found), object)
+                for m in (1, 2, 3):
+                    some = (upto[found] == m).nonzero()[0]
+                    sets[some] = map(set, izip(*[map(getface, vertexfaces[found[some], j].tolist())
+                                                 for j in range(m)]))
+                self.vertices.update(izip(map(getvertex, found.tolist()), sets))
+                for j in (1, 2):
+                    grown = ((before > 0) & (before <= j) & (upto > j)).nonzero()[0]
+                    for vertex, face in izip(map(getvertex, grown.tolist()),
+                                             map(getface, vertexfaces[grown, j].tolist())):
+                        self.vertices[vertex].add(face)
+                self._hold(batch, 1)
+
+                self._faceedges.update(perface(s, e, faceedges[a:b]))
+                self._neighbors.update(perface(s, e, map(getface, where(others[a:b] < e, others[a:b], n).tolist())))
+
+                # edges first found in this batch, with both faces if the
+                # second is in the batch too, then edges of earlier faces
+                # reaching this batch
+                new = (firstfaces >= s) & (firstfaces < e)
+                both = (new & (secondfaces < e)).nonzero()[0]
+                self._edgefaces.update(izip(map(getedge, both.tolist()), map(list, izip(
+                    map(getface, firstfaces[both].tolist()), map(getface, secondfaces[both].tolist())))))
+                one = (new & (secondfaces >= e)).nonzero()[0]
+                self._edgefaces.update(izip(map(getedge, one.tolist()), [
+                    [face] for face in map(getface, firstfaces[one].tolist())]))
+                joined = ((firstfaces < s) & (secondfaces >= s) & (secondfaces < e)).nonzero()[0]
+                for edge, f1, k, f2 in izip(map(getedge, joined.tolist()),
+                                            map(getface, firstfaces[joined].tolist()),
+                                            ks[firsts[joined]].tolist(),
+                                            map(getface, secondfaces[joined].tolist())):
+                    self._edgefaces[edge].append(f2)
+                    self._neighbors[f1][k] = f2
+        finally:
+            if collecting:
+                gc.enable()
+        instrument.count('faces populated', n)
+
+    # gets the grid as flat lists and tables of indices: face locations,
+    # face location array, (N,6) face->vertex table padded with -1, vertex
+    # locations, vertex location array and (N,3) vertex->face table with
+    # faces in the order they are iterated in self.vertices
+    def _tables(self):
+        faces, vertices = list(self.faces), list(self.vertices)
+        faceids = dict(izip(faces, count()))
+        vertexids = dict(izip(vertices, count()))
+        facevertices = full((len(faces), 6), -1, int32)
+        for f, face in enumerate(faces):
+            row = [vertexids[v] for v in self.faces[face]]
+            facevertices[f,:len(row)] = row
+        vertexfaces = full((len(vertices), 3), -1, int32)
+        for v, vertex in enumerate(vertices):
+            row = [faceids[f] for f in self.vertices[vertex]]
+            vertexfaces[v,:len(row)] = row
+        return (faces, array(faces, dtype=float), facevertices,
+                vertices, array(vertices, dtype=float), vertexfaces)
+
+    # true if every vertex has all three of its faces
+    def _complete(self):
+        return all([len(fs) == 3 for fs in self.vertices.itervalues()])
+
     def _addface(self, face):
         for vertex in self.faces[face]:
             if vertex not in self.vertices:
@@ -86,41 +393,161 @@ class Grid(object):
             if face not in vertexfaces:
                 vertexfaces.add(face)
 
+    def _indexface(self, face):
+        if face in self._faceedges:
+            return
+        edges = polygonedges(self.faces[face])
+        neighbors = []
+        for edge in edges:
+            faces = self._edgefaces.setdefault(edge, [])
+            faces.append(face)
+            if len(faces) == 2:
+                # first face on this edge gets its missing neighbor
+                other = faces[0]
+                self._neighbors[other][self._faceedges[other].index(edge)] = face
+                neighbors.append(other)
+            else:
+                neighbors.append(None)
+        self._faceedges[face] = edges
+        self._neighbors[face] = neighbors
+
+    def _removeface(self, face):
+        self._hold([face], -1)
+        for vertex in self.faces.pop(face):
+            faces = self.vertices[vertex]
+            faces.discard(face)
+            if len(faces) == 0:
+                del self.vertices[vertex]
+        for edge, neighbor in izip(self._faceedges.pop(face), self._neighbors.pop(face)):
+            faces = self._edgefaces[edge]
+            faces.remove(face)
+            if len(faces) == 0:
+                del self._edgefaces[edge]
+            if neighbor is not None:
+                self._neighbors[neighbor][self._faceedges[neighbor].index(edge)] = None
+        if face in self._addresses:
+            del self._addressfaces[self._addresses.pop(face)]
+
+    # makes a size 0 face, whose vertices are found from the three faces
+    # meeting at each
     def _makeface(self, newface, neighbors):
         vertices = []
         for n1, n2 in zip(neighbors, [neighbors[-1]] + neighbors):
-            # sort for floating-point consistency
+            # the faces play the same part, so are summed in sorted order
+            # for floating-point consistency
             faces = sorted((newface, n1, n2))
             vertices.append(
                 normal([sum([face[i] for face in faces]) for i in range(3)]))
-        self.faces[newface] = vertices
-        self._addface(newface)
+        self._setface(newface, vertices)
 
     # Populates grid by subdividing a single tile from the previous size
     #
-    # If face is omitted, full previous size is subdivided
-    def populate(self, previousface=None):
+    # If face is omitted, full previous size is subdivided, calling progress,
+    # if given, with the steps done so far and the total number of steps as
+    # it goes. progress may raise an exception to abandon the work, leaving
+    # the faces populated so far.
+    def populate(self, previousface=None, progress=None):
         if previousface is None:
-            for f in self.prev.faces:
-                self.populate(f)
+            with instrument.span('populate'):
+                if len(self.faces) == 0 and len(self.prev.faces) > 0 and self.prev._complete():
+                    self._subdivide(progress)
+                else:
+                    faces = list(self.prev.faces)
+                    for i, f in enumerate(faces):
+                        if progress is not None:
+                            progress(i, len(faces))
+                        self.populate(f)
+                    if progress is not None:
+                        progress(len(faces), len(faces))
             return
 
+        instrument.count('populate calls')
+
         if previousface in self.faces:
+            self._touch([previousface])
             return
+        self.populate_many([previousface])
 
-        if previousface not in self.prev.faces:
-            self.prev.populate(previousface)
+    # Populates grid by subdividing a batch of tiles from the previous size
+    #
+    # Works out the tiles of every smaller size the batch needs first, each
+    # once, from this size down, then subdivides them from the smallest size
+    # up. Sizes taken over budget then evict tiles, sparing the batch.
+    def populate_many(self, previousfaces):
+        previousfaces = set(previousfaces)
+        self._touch(previousfaces)
+        plan = []
+        grid, wanted = self, previousfaces
+        while True:
+            wanted = set([f for f in wanted if f not in grid.faces])
+            if len(wanted) == 0:
+                break
+            plan.append((grid, wanted))
+            below = set()
+            for f in wanted:
+                if f not in grid.prev.faces:
+                    # carried over from a smaller size, so subdivided from it
+                    below.add(f)
+                elif grid.prev.prev is not None and f not in grid.prev.prev.faces:
+                    # made from a vertex of the size before: its own vertices
+                    # need the faces around that vertex subdivided
+                    below.update(grid.prev.prev.vertices[f])
+            grid, wanted = grid.prev, below
 
-        for vertex in self.prev.faces[previousface]:
-            if len(self.prev.vertices[vertex]) < 3:
-                # implies p was new in prev
-                # i.e., p was a vertex in prev's prev
-                # implies p in prev prev had three faces
-                for neighbor in self.prev.prev.vertices[previousface]:
-                    self.prev.populate(neighbor)
+        for grid, faces in reversed(plan):
+            for f in sorted(faces):
+                grid._populateface(f)
+            grid._touch(faces)
 
+        # evicting from a size frees tiles of the size before it
+        for grid, faces in plan:
+            if grid.budget is not None and len(grid.faces) > grid.budget:
+                grid._evict(previousfaces if grid is self else faces)
+
+    # marks previous faces as the most recently populated
+    def _touch(self, previousfaces):
+        if self._recent is not None:
+            for f in previousfaces:
+                self._recent.pop(f, None)
+                self._recent[f] = True
+
+    # evicts the tiles of the least recently populated previous faces, other
+    # than those given, down to three quarters of the budget
+    def _evict(self, keep):
+        target = self.budget * 3 // 4
+        evicted = 0
+        for previousface in list(self._recent):
+            if len(self.faces) <= target:
+                break
+            if previousface in keep or previousface not in self.faces:
+                continue
+            # the face and those made from its vertices that no other
+            # subdivided face shares
+            faces = [previousface] + [
+                vertex for vertex in self.prev.faces[previousface]
+                if vertex in self.faces and not any(
+                    [f != previousface and f in self.faces for f in self.prev.vertices[vertex]])]
+            if any([face in self._holds for face in faces]):
+                continue
+            del self._recent[previousface]
+            for face in faces:
+                self._removeface(face)
+            evicted += len(faces)
+
+        if evicted > 0:
+            instrument.count('faces evicted', evicted)
+            # views start over from the log of the faces left
+            self._journal = [face for face in self._journal if face in self.faces]
+            self.evictions += 1
+
+    # subdivides a tile whose vertices in the previous size have all their
+    # faces
+    def _populateface(self, previousface):
         # face from face
-        self._makeface(previousface, self.prev.faces[previousface])
+        neighbors = self.prev.faces[previousface]
+        self._setface(previousface, [
+            corner(previousface, n1, n2)
+            for n1, n2 in zip(neighbors, [neighbors[-1]] + neighbors)])
 
         # faces from vertices
         for vertex in self.prev.faces[previousface]:
@@ -132,34 +559,243 @@ class Grid(object):
                     set(self.prev.faces[f1]) & set(self.prev.faces[f2]))
                 # new vertex at the midpoint between the two common old vertices and old face location
                 for neighbor in f1, f2:
-                    # sort for floating-point consistency
-                    faces = sorted([neighbor] + commonvertices)
-                    vertices.append(
-                        normal([sum([face[i] for face in faces]) for i in range(3)]))
+                    vertices.append(corner(neighbor, *commonvertices))
             # make sure new vertices wind correctly
             if dot(vertex, cross(*vertices[0:2])) < 0:
                 vertices = list(reversed(vertices))
-            self.faces[vertex] = vertices
-            self._addface(vertex)
+            self._setface(vertex, vertices)
+
+    # Subdivides the full previous size in one pass
+    #
+    # Produces the same tiles as calling populate for every previous face,
+    # with each new vertex computed once as an array operation. progress is
+    # called at the start, between its three steps, as the new tiles are
+    # stored and when done, each step counting as one per tile.
+    def _subdivide(self, progress=None):
+        if progress is None:
+            progress = lambda done, total: None
+        progress(0, 3)
+        (faces, facelocs, facevertices,
+            vertices, vertexlocs, vertexfaces) = self.prev._tables()
+        nf, nv = len(faces), len(vertices)
+        n = nf + nv
+        degrees = (facevertices >= 0).sum(axis=1)
+        columns = arange(6)
+
+        # new vertex at slot k of each previous face lies between the face
+        # and its previous vertices k and k-1
+        before = facevertices[arange(nf)[:,None], (columns - 1) % degrees[:,None]]
+        valid = columns < degrees[:,None]
+        fs, ks = valid.nonzero()
+        # added in the order corner adds them
+        newlocs = _normals(facelocs[fs] + (
+            vertexlocs[facevertices[fs, ks]] + vertexlocs[before[fs, ks]]))
+        slots = full((nf, 6), -1, int32)
+        slots[fs, ks] = arange(len(fs))
+        progress(n, 3 * n)
+
+        # position of each vertex within each of its three faces
+        positions = zeros((nv, 3), int32)
+        for k in range(6):
+            f = fs[ks == k]
+            v = facevertices[f, k]
+            positions[v, (vertexfaces[v] == f[:,None]).argmax(axis=1)] = k
+
+        # faces from vertices: for each pair of faces meeting at a previous
+        # vertex, the two new vertices either side of their common edge
+        rows = zeros((nv, 6), int32)
+        for j in range(3):
+            f1, f2 = vertexfaces[:,j], vertexfaces[:,(j + 1) % 3]
+            k1, k2 = positions[:,j], positions[:,(j + 1) % 3]
+            d1, d2 = degrees[f1], degrees[f2]
+            # the common edge is either just before or just after the
+            # vertex in the first face
+            w = facevertices[f1, (k1 - 1) % d1]
+            shared = (facevertices[f2] == w[:,None]).any(axis=1)
+            w = where(shared, w, facevertices[f1, (k1 + 1) % d1])
+            rows[:,2*j] = slots[f1, where(shared, k1, (k1 + 1) % d1)]
+            rows[:,2*j + 1] = slots[f2, where(
+                facevertices[f2, (k2 - 1) % d2] == w, k2, (k2 + 1) % d2)]
+        # make sure new vertices wind correctly
+        reverse = _dots(vertexlocs, _crosses(newlocs[rows[:,0]], newlocs[rows[:,1]])) < 0
+        rows[reverse] = rows[reverse][:,::-1]
+
+        # add tiles in the order individual populate calls would have
+        order = full((nf, 7), -1, int32)
+        order[:,0] = arange(nf)
+        order[:,1:] = where(facevertices >= 0, facevertices + nf, -1)
+        order = order[order >= 0]
+        order = order[sort(unique(order, return_index=True)[1])]
+
+        table = full((nf + nv, 6), -1, int32)
+        table[:nf] = slots
+        table[nf:] = rows
+        progress(2 * n, 3 * n)
+        self._setlevel(
+            [faces[i] if i < nf else vertices[i - nf] for i in order.tolist()],
+            map(tuple, newlocs.tolist()),
+            table[order],
+            lambda done: progress(2 * n + done, 3 * n))
+        progress(3 * n, 3 * n)
 
+    # edges of a face as sorted vertex pairs, in vertex order
+    #
+    # The returned list is shared and must not be modified.
     def edges(self, face):
-        vertices = self.faces[face]
-        return [tuple(sorted(vs)) for vs in zip(vertices, vertices[1:] + vertices[0:1])]
+        return self._faceedges[face]
 
     def borders(self, face, edge):
         edges = self.edges(face)
         source = edges.index(edge)
         return edges[source + 1:] + edges[:source]
 
+    # faces across each of a face's edges, in edge order, with None for
+    # those not yet populated
+    def neighbors(self, face):
+        return self._neighbors[face]
+
     def neighbor(self, face, border):
         # each edge has two common faces (if they exist in the grid)
-        common = self.vertices[border[0]] & self.vertices[border[1]]
-        if len(common) == 2:
-            return list(common - { face })[0]
+        faces = self._edgefaces.get(border)
+        if faces is None:
+            faces = self._edgefaces[tuple(sorted(border))]
+        if len(faces) == 2:
+            return faces[1] if faces[0] == face else faces[0]
+
+    def address(self, face):
+        if face not in self._addresses:
+            if self.prev is None:
+                address = dodecfaces.index(face)
+            elif face in self.prev.faces:
+                address = self.prev.address(face) << 3
+            else:
+                parent = min(self.prev.vertices[face], key=self.prev.address)
+                rank = sorted(self.prev.faces[parent]).index(face)
+                address = self.prev.address(parent) << 3 | 1 + rank
+            self._addresses[face] = address
+            self._addressfaces[address] = face
+        return self._addresses[face]
+
+    # gets the face with the given address, populating it if necessary
+    def face(self, address):
+        if address not in self._addressfaces:
+            if self.prev is None:
+                face = dodecfaces[address]
+            else:
+                parent = self.prev.face(address >> 3)
+                self.populate(parent)
+                digit = address & 7
+                vertices = sorted(self.prev.faces[parent])
+                if digit > len(vertices):
+                    raise KeyError(address)
+                face = parent if digit == 0 else vertices[digit - 1]
+            if self.address(face) != address:
+                raise KeyError(address)
+        return self._addressfaces[address]
+
+    # face of the previous size this face was subdivided from
+    def parent(self, face):
+        return self.prev.face(self.address(face) >> 3)
+
+    # faces subdivided from a face of the previous size, in address order
+    def children(self, previousface):
+        self.populate(previousface)
+        address = self.prev.address(previousface)
+        return [previousface] + [
+            vertex for vertex in sorted(self.prev.faces[previousface])
+            if self.address(vertex) >> 3 == address]
+
+    # face of a smaller size this face was (eventually) subdivided from
+    def ancestor(self, face, size):
+        grid = self
+        while grid.size > size:
+            grid = grid.prev
+        return grid.face(self.address(face) >> 3 * (self.size - size))
+
+    # Faces added since a position in the log of added faces
+    #
+    # Returns the faces, in the order they were added, and the position to
+    # pass next time. Position 0 is the empty grid. Evicting tiles rewrites
+    # the log to hold only the faces left and increments evictions, after
+    # which positions start over from 0.
+    def changes(self, since=0):
+        return self._journal[since:], len(self._journal)
+
+    # numbers of tiles held at each size, smallest first, as (size, tiles,
+    # budget) tuples
+    def resident(self):
+        sizes = []
+        grid = self
+        while grid is not None:
+            sizes.insert(0, (grid.size, len(grid.faces), grid.budget))
+            grid = grid.prev
+        return sizes
+
+    # populates all faces adjacent to a face
+    def populateneighbors(self, face):
+        # a face carried over from the previous size has its neighbors made
+        # along with it; one made from a previous vertex needs the faces
+        # around that vertex subdivided too
+        if self.prev is not None and face not in self.prev.faces:
+            self.populate_many(self.prev.vertices[face])
+
+    # Finds the face nearest a vector on the unit sphere
+    #
+    # The nearest face of each smaller size is carried over to the next,
+    # from where a greedy walk across neighbors finds the nearest face of
+    # that size, so only tiles along the way are populated.
+    def locate(self, vector):
+        if self.prev is None:
+            return max(dodecfaces, key=lambda f: dot(f, vector))
+        face = self.prev.locate(vector)
+        self.populate(face)
+        closeness = dot(face, vector)
+        while True:
+            self.populateneighbors(face)
+            nearest = max(self.neighbors(face), key=lambda f: dot(f, vector))
+            if dot(nearest, vector) <= closeness:
+                return face
+            face, closeness = nearest, dot(nearest, vector)
+
+    # Finds the k faces nearest a vector, nearest first
+    def nearest_k(self, vector, k):
+        start = self.locate(vector)
+        found, seen = [], { start }
+        q = [(-dot(start, vector), start)]
+        while len(q) > 0 and len(found) < k:
+            _, face = heappop(q)
+            found.append(face)
+            self.populateneighbors(face)
+            for neighbor in self.neighbors(face):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    heappush(q, (-dot(neighbor, vector), neighbor))
+        return found
+
+    # Writes this grid and all smaller sizes to a binary file (see gridfile)
+    def save(self, path):
+        import gridfile
+        gridfile.save(self, path)
+
+    # Reads a grid hierarchy written by save, memory-mapping its tables
+    #
+    # Returns the largest size, as an ArrayGrid.
+    @staticmethod
+    def load(path):
+        import gridfile
+        return gridfile.load(path)
 
     # get the radian distance between adjacent faces
     # neighboring hexes are used for grid sizes > 0
+    #
+    # The distance is found once, so that it can be asked for on another
+    # thread while the grid is populated.
     def scale(self):
+        if self._scale is None:
+            self._scale = self._findscale()
+        return self._scale
+
+    def _findscale(self):
         found = False
         for f, vs in self.faces.iteritems():
             if len(vs) == 6:
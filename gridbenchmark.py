@@ -0,0 +1,63 @@
+# Compares memory use and subdivision throughput of the dictionary-backed
+# Grid against the array-backed ArrayGrid
+#
+#   python gridbenchmark.py [maxsize]
+#
+# For each size from 0 up to maxsize (default 8), reports the time taken to
+# fully populate the grid from the previous size, or for size 0 to make the
+# dodecahedron it starts from, the resulting faces per second,
+# and the approximate number of bytes held by that size's own storage.
+
+from sys import argv, getsizeof
+from time import time
+
+from numpy import ndarray
+
+from arraygrid import ArrayGrid
+from grid import Grid
+
+# approximate number of bytes reachable from obj, skipping anything in seen
+def footprint(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, ndarray):
+        # arrays owning their data include it in getsizeof
+        return getsizeof(obj) if obj.base is None else obj.nbytes
+    size = getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum([footprint(k, seen) + footprint(v, seen) for k, v in obj.iteritems()])
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum([footprint(item, seen) for item in obj])
+    elif hasattr(obj, '__dict__'):
+        size += footprint(obj.__dict__, seen)
+    return size
+
+# bytes held by a single size of a grid, excluding the smaller sizes
+def gridfootprint(grid):
+    return footprint(grid, { id(grid.prev) })
+
+def run(cls, maxsize):
+    results = []
+    grid = None
+    for size in range(0, maxsize + 1):
+        start = time()
+        if grid is None:
+            grid = cls()
+        else:
+            grid = cls(grid)
+            grid.populate()
+        elapsed = time() - start
+        results.append((size, len(grid.faces), elapsed, gridfootprint(grid)))
+    return results
+
+def main(maxsize):
+    print '{:<9} {:>4} {:>9} {:>12} {:>12} {:>14}'.format(
+        'grid', 'size', 'faces', 'seconds', 'faces/s', 'bytes')
+    for cls in Grid, ArrayGrid:
+        for size, faces, elapsed, bytes in run(cls, maxsize):
+            print '{:<9} {:>4} {:>9} {:>12.3f} {:>12.0f} {:>14,}'.format(
+                cls.__name__, size, faces, elapsed, faces / elapsed if elapsed > 0 else float('inf'), bytes)
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 8)
@@ -1,2 +1,10 @@
-import griddetail
-GridDetail = griddetail.GridDetail
+try:
+    import PySide
+except ImportError:
+    # without PySide only the Qt-free modules, such as layout, are available
+    pass
+else:
+    import griddetail
+    import prefetch
+    GridDetail = griddetail.GridDetail
+    Prefetcher = prefetch.Prefetcher
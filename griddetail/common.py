@@ -1,8 +1,5 @@
-from math import sqrt
-
 N, NW, SW, S, SE, NE = range(6)
 dirs = ['N', 'NW', 'SW', 'S', 'SE', 'NE']
-offsets = [(0, -2*sqrt(3)), (-3, -sqrt(3)), (-3, sqrt(3)), (0, 2*sqrt(3)), (3, sqrt(3)), (3, -sqrt(3))]
 
 def rotatedirection(direction, steps):
     return (direction + steps) % 6
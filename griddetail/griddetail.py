@@ -2,11 +2,27 @@
 
 from PySide.QtGui import QFont, QFontDatabase, QGraphicsScene
 
+import instrument
+
 from hexgrid import HexGrid
 from legend import Legend
 
 from common import N, NW, NE, S, SE, SW, dirs, borders
 
+_font = None
+
+# the detail view's font, loaded the first time it is needed
+def font():
+    global _font
+    if _font is None:
+        _font = QFont(QFontDatabase.applicationFontFamilies(QFontDatabase.addApplicationFont('FreeMono.otf'))[0])
+        _font.setPointSize(14)
+    return _font
+
+# Detail view of the tiles around a center tile
+#
+# The view keeps its scene as it moves and rotates, updating the tiles in
+# place rather than building a new scene each time.
 class GridDetail(object):
     def __init__(self, grid, colors, center, (poilocation, poilabel), scale, orientation=None):
         self.scene = QGraphicsScene()
@@ -14,25 +30,33 @@ class GridDetail(object):
         self.grid = grid
         self.colors = colors
 
-        self._center = center
-
         self._pointofinterest = (poilocation, poilabel)
         self._scale = scale
 
+        self._poimark = u'★'
+        self._hexgrid = HexGrid(self.scene, self.grid, self.colors, font(), self._poimark)
+        self._legend = None
+
         # default to arbitrarily chosen local North edge
-        self._orientation = (S, tuple(sorted(grid.faces[center][0:2]))) if orientation is None else orientation
+        self._show(center, (S, tuple(sorted(grid.faces[center][0:2]))) if orientation is None else orientation)
+
+    def _show(self, center, orientation):
+        self._center = center
+        self._orientation = orientation
 
-        font = QFont(QFontDatabase.applicationFontFamilies(QFontDatabase.addApplicationFont('FreeMono.otf'))[0])
-        font.setPointSize(14)
+        poilocation, poilabel = self._pointofinterest
+        with instrument.span('detail scene'):
+            self._hexgrid.update(center, orientation, poilocation)
 
-        poimark = u'★'
-        hexgrid = HexGrid(self.scene, self.grid, self.colors, self._center, self._orientation, font, (poilocation, poimark))
-        legend = Legend(self.scene, font, (hexgrid.poidirection, poilabel, poimark), scale)
+            if self._legend is not None:
+                self.scene.removeItem(self._legend.group)
+            self._legend = Legend(self.scene, font(), (self._hexgrid.poidirection, poilabel, self._poimark), self._scale)
+            instrument.count('scene items', len(self._legend.group.childItems()))
 
-        self._groups = [obj.group for obj in hexgrid, legend]
-        gridsize, legendsize = [group.boundingRect() for group in self._groups]
-        self._groups[-1].translate(gridsize.x() - legendsize.width()/2, gridsize.y() + gridsize.height() + legendsize.height()/2)
-        self._groups[-1].setZValue(1)
+            gridsize, legendsize = self._hexgrid.boundingRect(), self._legend.group.boundingRect()
+            self._legend.group.translate(gridsize.x() - legendsize.width()/2, gridsize.y() + gridsize.height() + legendsize.height()/2)
+            self._legend.group.setZValue(1)
+            self.scene.setSceneRect(self.scene.itemsBoundingRect())
 
     @property
     def orientation(self):
@@ -46,14 +70,20 @@ class GridDetail(object):
         orientation = self._orientation
         for nextdir, border in borders(self.grid, self._center, *orientation):
             if nextdir == dirs.index(direction):
-                face = self.grid.neighbor(self._center, border)
+                edge = border
                 break
         else:
-            face = self.grid.neighbor(self._center, orientation[1])
-        edge = list(set(self.grid.edges(self._center)) & set(self.grid.edges(face)))[0]
-        return GridDetail(self.grid, self.colors, face, self._pointofinterest, self._scale, ((dirs.index(direction) + 3) % 6, edge))
+            edge = orientation[1]
+        face = self.grid.neighbor(self._center, edge)
+        self._show(face, ((dirs.index(direction) + 3) % 6, edge))
+        return self
 
     def rotate(self, rotation):
         change = 1 if rotation == 'CW' else -1
         direction, edge = self._orientation
-        return GridDetail(self.grid, self.colors, self._center, self._pointofinterest, self._scale, (direction + change, edge))
+        self._show(self._center, (direction + change, edge))
+        return self
+
+    # lets the grid evict the tiles in view, once the view is replaced
+    def close(self):
+        self._hexgrid.release()
@@ -1,149 +1,123 @@
 # coding: utf-8
 
-from math import acos, atan2, pi, sqrt
+from math import acos, atan2, pi
 
 from PySide.QtCore import QPointF, Qt
-from PySide.QtGui import QColor, QFontMetrics, QMatrix, QPen, QPolygonF
+from PySide.QtGui import QColor, QFontMetrics, QPen, QPolygonF
 
-from common import N, NW, NE, S, SE, SW, offsets, borders, rotatedirection
+from colors.base import facecolors
+import instrument
 
-vs = [(-1, -sqrt(3)), (1, -sqrt(3)), (2, 0), (1, sqrt(3)), (-1, sqrt(3)), (-2, 0)]
-hexproto = QPolygonF([QPointF(*cs) for cs in vs])
-pentproto = QPolygonF([QPointF(*cs) for cs in [(0, -sqrt(3))] + vs[2:]])
-
-def distancesquared(v):
-    return sum([vi * vi for vi in v])
+from layout import hexvertices, Layout
 
 def dot(v1, v2):
     return sum([v1[i] * v2[i] for i in range(len(v1))])
 
-radius = 5
-radiussquared = radius * radius * distancesquared(offsets[0])
-
-class HexGrid(object):
-    def __init__(self, scene, grid, colors, face, orientation, font, (poilocation, poilabel)):
-        faceitems = self._buildgrid(scene, grid, colors, face, *orientation)
+def _polygon(vertices):
+    return QPolygonF([QPointF(*v) for v in vertices])
 
-        items = faceitems.values()
-        items.append(self._addglyph(scene, font, u'@', faceitems[face]))
+hexproto = _polygon(hexvertices)
 
-        edgelength = abs(acos(dot(*orientation[1])))
-        ingrid, item = self._findpointofinterest(faceitems, poilocation, edgelength)
+# Tiles of the detail view, kept in a scene across moves
+#
+# Tiles are laid out by griddetail.layout, then handed to the scene: each
+# tile's polygon is drawn about the origin and placed at its offset, so
+# that moving the view around the grid only repositions the tiles that stay
+# in view, adds those coming into view and removes those leaving it.
+class HexGrid(object):
+    def __init__(self, scene, grid, colors, font, poilabel):
+        self._scene = scene
+        self._grid = grid
+        self._colors = colors
+        self._font = font
+        self._poilabel = poilabel
+
+        # face -> polygon item and its vertices, for the tiles in view
+        self._items = {}
+        self._shapes = {}
+        self._layout = None
+
+        self._addglyph(u'@', (0, 0))
+        self._poi = None
+        self.poidirection = None
+
+    # lays the tiles out around face, with the orientation's edge of it on
+    # the side in the orientation's direction
+    def update(self, face, orientation, poilocation):
+        direction, edge = orientation
+        layout = Layout(self._grid, face, direction, edge)
+        self.release()
+        self._layout = layout
+
+        for f in self._items.keys():
+            if f not in layout.coords:
+                self._scene.removeItem(self._items.pop(f))
+                del self._shapes[f]
+
+        # color the tiles coming into view all at once
+        new = [f for f, _ in layout.tiles if f not in self._items]
+        for f, color in zip(new, facecolors(self._colors, new).tolist()):
+            self._items[f] = self._addpoly(color)
+            self._shapes[f] = hexvertices
+
+        for f, _ in layout.tiles:
+            item = self._items[f]
+            item.setPos(*layout.offset(f))
+            shape = layout.shape(f)
+            if shape != self._shapes[f]:
+                item.setPolygon(_polygon(shape))
+                self._shapes[f] = shape
+
+        if self._poi is not None:
+            self._scene.removeItem(self._poi)
+            self._poi = None
+        edgelength = abs(acos(dot(*edge)))
+        ingrid, offset = self._findpointofinterest(poilocation, edgelength)
         if ingrid:
-            items.append(self._addglyph(scene, font, poilabel, item))
+            self._poi = self._addglyph(self._poilabel, offset)
             self.poidirection = None
         else:
-            loc = item.boundingRect().center()
-            self.poidirection = 90 + 180 * atan2(loc.y(), loc.x()) / pi
+            self.poidirection = 90 + 180 * atan2(offset[1], offset[0]) / pi
 
-        self.group = scene.createItemGroup(items)
+    # lets the grid evict the tiles in view
+    def release(self):
+        if self._layout is not None:
+            self._layout.release()
+            self._layout = None
 
-    def _shapecolors(self, colors, face):
-        rgb = [s * 255 for s in colors[face]]
-        return (QPen(Qt.transparent), QColor(*rgb))
+    # scene rectangle covered by the tiles
+    def boundingRect(self):
+        rects = [item.sceneBoundingRect() for item in self._items.itervalues()]
+        return reduce(lambda r1, r2: r1.united(r2), rects)
 
-    def _addpoly(self, scene, colors, prototype, offset, face, rotation):
-        item = scene.addPolygon(prototype.translated(*offset), *self._shapecolors(colors, face))
-        item.setTransformOriginPoint(*offset)
-        item.setRotation(rotation)
-        return item
+    def _shapecolors(self, color):
+        rgb = [s * 255 for s in color]
+        return (QPen(Qt.transparent), QColor(*rgb))
 
-    def _populatevertex(self, grid, face, vertex):
-        if len(grid.vertices[vertex]) < 3:
-            for neighbor in grid.prev.vertices[face]:
-                grid.populate(neighbor)
+    def _addpoly(self, color):
+        instrument.count('scene items')
+        return self._scene.addPolygon(hexproto, *self._shapecolors(color))
 
-    @staticmethod
-    def _addoffsets(o1, o2):
-        return tuple([o1[i] + o2[i] for i in range(2)])
+    def _findpointofinterest(self, location, r):
+        layout = self._layout
+        face = self._grid.locate(location)
+        if face in layout.coords:
+            return True, layout.offset(face)
 
-    def _findpointofinterest(self, faceitems, location, r):
+        # off the grid: find the closest tile to point toward it
         mindist = float('inf'), None
-        for face, item in faceitems.iteritems():
+        for face in layout.coords:
             dist = abs(acos(dot(face, location)))
             if dist < mindist[0] or (dist == mindist[0] and face < mindist[1]):
-                mindist = dist, face, item
-        return mindist[0] < r, mindist[2]
-
-    def _addhexes(self, scene, grid, colors, face, direction, edge):
-        faceitems = {}
-        # store pentagons for further processing
-        pentfaces = set()
-
-        # queue items are (face, direction traversed from, edge crossed, offset) tuples
-        q = [(face, direction, edge, (0,0))]
-        seen = set()
-        while len(q) > 0:
-            face, whence, edge, offset = q.pop()
-            if face not in seen:
-                # add tile to the scene
-                seen.add(face)
-                faceitems[face] = self._addpoly(scene, colors, hexproto, offset, face, 0)
-
-                # for each other edge
-                for nextdir, border in borders(grid, face, whence, edge):
-                    # ensure the neighboring face is populated
-                    for v in border:
-                       self._populatevertex(grid, face, v)
-                    nextoffset = self._addoffsets(offset, offsets[nextdir])
-                    if distancesquared(nextoffset) < radiussquared:
-                        # enqueue for processing
-                        q.insert(0, (grid.neighbor(face, border), (nextdir + 3) % 6, border, nextoffset))
-                if len(grid.faces[face]) == 5:
-                    pentfaces.add((face, offset))
-
-        return faceitems, pentfaces
-
-    def _distortvertex(self, scene, offset, displacement, vertexindex, rotation):
-        item = scene.itemAt(*self._addoffsets(offset, displacement))
-        polygon = item.polygon()
-        matrix = QMatrix()
-        matrix.rotate(rotation)
-        rotated = matrix.map(pentproto.value(0)).toTuple()
-        polygon.replace(vertexindex, QPointF(*self._addoffsets(rotated, offset)))
-        item.setPolygon(polygon)
-
-    def _addpents(self, scene, colors, oldfaceitems, pents):
-        faceitems = dict(oldfaceitems)
-        for face, offset in pents:
-            # replace hex tile with a pentagon
-            item = scene.itemAt(*offset)
-            scene.removeItem(item)
-
-            # pentagons are drawn by replacing three sides of a hex with two
-            # new sides: find which neighboring tiles are populated to orient
-            # the new vertex in the most aesthetic way
-            populated = []
-            for ni in range(len(offsets)):
-                if scene.itemAt(*self._addoffsets(offset, offsets[ni])) is not None:
-                    if len(populated) > 0 and populated[-1] + 1 != ni:
-                        ni -= 6
-                    populated.append(ni)
-            base = sorted(populated)[len(populated)/2] if len(populated) > 0 else 0
-
-            rotation = -60 * (base + 3)
-            faceitems[face] = self._addpoly(scene, colors, pentproto, offset, face, rotation)
-            for counter in (0, 1):
-                # look for neighbors two clockwise and two counter- from base
-                steps = -2 + 4*counter
-                ni = rotatedirection(base, steps)
-                if ni in [n%6 for n in populated]:
-                    self._distortvertex(
-                        scene,
-                        offset,
-                        offsets[ni],
-                        rotatedirection(3, -ni + counter),
-                        rotation)
-        return faceitems
-
-    def _buildgrid(self, scene, grid, colors, face, direction, edge):
-        faceitems, pents = self._addhexes(scene, grid, colors, face, direction, edge)
-        return self._addpents(scene, colors, faceitems, pents)
-
-    def _addglyph(self, scene, font, glyph, item):
-        offset = item.boundingRect().center().toTuple()
-        text = scene.addText(glyph, font)
-        metrics = QFontMetrics(font)
-        text.translate(offset[0] - metrics.width(glyph) * 0.2, offset[1] - metrics.height() * 0.2)
+                mindist = dist, face
+        return mindist[0] < r, layout.offset(mindist[1])
+
+    def _addglyph(self, glyph, offset):
+        instrument.count('scene items')
+        text = self._scene.addText(glyph, self._font)
+        metrics = QFontMetrics(self._font)
+        text.translate(-metrics.width(glyph) * 0.2, -metrics.height() * 0.2)
         text.scale(0.2, 0.2)
+        text.setPos(*offset)
+        text.setZValue(1)
         return text
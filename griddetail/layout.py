@@ -0,0 +1,159 @@
+# Placement and shapes of tiles in the detail view, independent of Qt
+#
+# Tiles are laid out as hexes around a center face out to a fixed radius,
+# each at integer axial coordinates (q, r): a step in direction N is
+# (0, -1), NW (-1, 0), and so on around. Coordinates convert to offsets in
+# scene units, at which each tile's polygon is drawn about the origin.
+
+from collections import deque
+from math import cos, radians, sin, sqrt
+
+from common import borders, rotatedirection
+import instrument
+
+radius = 5
+
+# axial steps in each direction, in the order of common.dirs
+directions = [(0, -1), (-1, 0), (-1, 1), (0, 1), (1, 0), (1, -1)]
+
+# hex and pentagon vertices, the pentagon replacing a hex's top three sides
+# with two
+hexvertices = ((-1, -sqrt(3)), (1, -sqrt(3)), (2, 0), (1, sqrt(3)), (-1, sqrt(3)), (-2, 0))
+pentvertices = ((0, -sqrt(3)),) + hexvertices[2:]
+
+def addcoords(c1, c2):
+    return (c1[0] + c2[0], c1[1] + c2[1])
+
+# scene offset of the tile at axial coordinates
+def offset((q, r)):
+    return (3 * q, sqrt(3) * (q + 2 * r))
+
+# true for coordinates within the layout's radius, or another
+def inside((q, r), limit=radius):
+    return q*q + q*r + r*r < limit * limit
+
+# a point rotated clockwise on screen (y down) by degrees, as Qt rotates
+def rotate((x, y), degrees):
+    a = radians(degrees)
+    return (x * cos(a) - y * sin(a), x * sin(a) + y * cos(a))
+
+# Walks out from a face, with the edge of it given on the side in direction
+#
+# Yields (face, coordinates) pairs in breadth-first order, as far as within
+# allows, each face once. The neighbors of each face are populated after it
+# is yielded, so the walk does its work a step at a time. Faces are pinned
+# from when they are queued until the walk ends, so populating those
+# further out can't evict them in between.
+def walk(grid, face, direction, edge, within):
+    seen = set()
+    # queue items are (face, direction traversed from, edge crossed, coordinates) tuples
+    q = deque([(face, direction, edge, (0, 0))])
+    pinned = [face]
+    grid.pin(pinned)
+    try:
+        while len(q) > 0:
+            face, whence, edge, coords = q.popleft()
+            if face in seen:
+                continue
+            seen.add(face)
+            yield face, coords
+
+            # ensure the neighboring faces are populated
+            grid.populateneighbors(face)
+
+            # for each other edge
+            for nextdir, border in borders(grid, face, whence, edge):
+                nextcoords = addcoords(coords, directions[nextdir])
+                if within(nextcoords):
+                    neighbor = grid.neighbor(face, border)
+                    grid.pin([neighbor])
+                    pinned.append(neighbor)
+                    q.append((neighbor, (nextdir + 3) % 6, border, nextcoords))
+    finally:
+        grid.unpin(pinned)
+
+# Faces up to depth tiles beyond a layout's radius, within 60 degrees of
+# the heading direction, nearest first
+#
+# Laid out as walk lays them out, populating their neighbors as it goes:
+# taking the faces ahead of where the view is moving populates what the
+# layouts after the next few moves will need.
+def ahead(grid, face, direction, edge, heading, depth=2):
+    hx, hy = offset(directions[heading])
+    def within(coords):
+        if inside(coords):
+            return True
+        x, y = offset(coords)
+        return (inside(coords, radius + depth) and
+                2 * (x*hx + y*hy) >= sqrt((x*x + y*y) * (hx*hx + hy*hy)))
+    for face, coords in walk(grid, face, direction, edge, within):
+        if not inside(coords):
+            yield face
+
+# Tiles around a face, with the edge of it given on the side in direction
+#
+# tiles lists (face, coordinates) pairs in breadth-first order, coords and
+# faces map between faces and coordinates, pents lists the pentagons, and
+# shapes gives the vertices of each tile that is not a plain hex.
+# Neighboring faces are populated as they are reached. The tiles are pinned
+# in the grid until release is called.
+class Layout(object):
+    def __init__(self, grid, face, direction, edge):
+        with instrument.span('detail layout'):
+            self._place(grid, face, direction, edge)
+            self._shape()
+        self._grid = grid
+        grid.pin(self.coords)
+
+    def release(self):
+        self._grid.unpin(self.coords)
+
+    def _place(self, grid, face, direction, edge):
+        self.tiles, self.coords, self.faces, self.pents = [], {}, {}, []
+        for face, coords in walk(grid, face, direction, edge, inside):
+            self.tiles.append((face, coords))
+            self.coords[face] = coords
+            # tiles can meet at the same coordinates around pentagons: the
+            # last found is drawn on top
+            self.faces[coords] = face
+            if len(grid.faces[face]) == 5:
+                self.pents.append(face)
+
+    def _shape(self):
+        self.shapes = {}
+        for face in self.pents:
+            coords = self.coords[face]
+            # pentagons are drawn by replacing three sides of a hex with two
+            # new sides: find which neighboring tiles are populated to orient
+            # the new vertex in the most aesthetic way
+            populated = []
+            for ni in range(len(directions)):
+                if addcoords(coords, directions[ni]) in self.faces:
+                    if len(populated) > 0 and populated[-1] + 1 != ni:
+                        ni -= 6
+                    populated.append(ni)
+            base = sorted(populated)[len(populated)/2] if len(populated) > 0 else 0
+
+            rotation = -60 * (base + 3)
+            self.shapes[face] = tuple([rotate(v, rotation) for v in pentvertices])
+            vertex = rotate(pentvertices[0], rotation)
+            for counter in (0, 1):
+                # look for neighbors two clockwise and two counter- from base,
+                # moving their corner to the pentagon's new vertex
+                steps = -2 + 4*counter
+                ni = rotatedirection(base, steps)
+                if ni in [n%6 for n in populated]:
+                    neighbor = self.faces[addcoords(coords, directions[ni])]
+                    displacement = offset(directions[ni])
+                    shape = list(self.shape(neighbor))
+                    shape[rotatedirection(3, -ni + counter)] = (
+                        vertex[0] - displacement[0], vertex[1] - displacement[1])
+                    self.shapes[neighbor] = tuple(shape)
+
+    # scene offset of a tile
+    def offset(self, face):
+        return offset(self.coords[face])
+
+    # vertices of a tile, about its offset
+    def shape(self, face):
+        return self.shapes.get(face, hexvertices)
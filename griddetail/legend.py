@@ -4,7 +4,8 @@ from math import sqrt
 
 from PySide.QtGui import QColor, QFontMetrics, QPen
 
-from common import N, NW, NE, S, SE, SW, offsets
+from common import N, NW, NE, S, SE, SW
+import layout
 
 class Legend(object):
     def __init__(self, scene, font, poiinfo, scaleinfo):
@@ -31,7 +32,7 @@ class Legend(object):
 
         pen = QPen(self._color())
         y = offset * 0.2
-        w = scalelen * abs(offsets[N][1])
+        w = scalelen * abs(layout.offset(layout.directions[N])[1])
         h = metrics.height() * 0.2
 
         lines = []
@@ -0,0 +1,52 @@
+from time import time
+
+from PySide.QtCore import QObject, QTimer, Signal
+
+import instrument
+
+from layout import ahead
+
+# Populates tiles ahead of the detail view while the UI is idle
+#
+# follow starts over from a view's center, heading away from the edge it
+# is oriented by, which after a move is the way it moved. The work is done
+# from a zero-interval timer in slices of at most budget seconds, so input
+# is handled between them. populated is emitted once the tiles ahead are
+# done, if any had to be added or others were evicted.
+class Prefetcher(QObject):
+    populated = Signal()
+
+    def __init__(self, budget=0.005, parent=None):
+        QObject.__init__(self, parent)
+        self.budget = budget
+        self._walk = None
+        self._timer = QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._step)
+
+    def follow(self, detail):
+        self.stop()
+        direction, edge = detail.orientation
+        self._grid = detail.grid
+        self._before = len(self._grid.faces), self._grid.evictions
+        self._walk = ahead(self._grid, detail.center, direction, edge, (direction + 3) % 6)
+        self._timer.start()
+
+    # ends the walk, unpinning the faces it had queued
+    def stop(self):
+        self._timer.stop()
+        if self._walk is not None:
+            self._walk.close()
+        self._walk = None
+
+    def _step(self):
+        end = time() + self.budget
+        with instrument.span('prefetch'):
+            try:
+                while time() < end:
+                    next(self._walk)
+                return
+            except StopIteration:
+                self.stop()
+        if (len(self._grid.faces), self._grid.evictions) != self._before:
+            self.populated.emit()
@@ -0,0 +1,108 @@
+# Binary on-disk format for grid hierarchies
+#
+# A file holds every size of a grid from the dodecahedron up, so that fully
+# or partially populated grids can be loaded instead of rebuilt. All values
+# are little-endian. The header is:
+#
+#   magic      8 bytes, 'HEYGRID\0'
+#   version    uint32
+#   size       uint32, size of the largest grid
+#
+# followed by one entry per size, from 0 to size:
+#
+#   faces      uint64, number of populated faces
+#   vertices   uint64, number of vertices
+#
+# After the header come the tables for each size in turn, each padded to a
+# multiple of 8 bytes:
+#
+#   face locations    float64 (faces, 3)
+#   face vertices     int32 (faces, 6), vertex IDs, -1 padded for pentagons
+#   vertex locations  float64 (vertices, 3)
+#   vertex faces      int32 (vertices, 3), face IDs, -1 if not populated
+#
+# Faces and vertices are numbered in the order their locations sort in, so
+# that they can be looked up by binary search. Loading memory-maps the
+# tables copy-on-write rather than parsing them.
+
+from os import rename
+from struct import calcsize, pack, unpack
+
+from numpy import dtype, empty, int32, memmap, ndarray, where, zeros
+
+from arraygrid import locationorder, ArrayGrid
+
+magic = 'HEYGRID\0'
+# version 2: vertices computed by grid.corner, which can differ in the last
+# bit from version 1's
+# version 3: faces and vertices numbered in location order
+version = 3
+
+header = '<8sII'
+entry = '<QQ'
+
+# dtype and row width of each table, in file order
+tables = [('<f8', 3), ('<i4', 6), ('<f8', 3), ('<i4', 3)]
+
+def _padding(offset):
+    return -offset % 8
+
+def _levels(grid):
+    levels = []
+    while grid is not None:
+        levels.insert(0, grid)
+        grid = grid.prev
+    return levels
+
+# renumbers rows of a table as given by order, giving the new number of each
+# old one
+def _renumber(order):
+    numbers = empty(len(order), int32)
+    numbers[order] = range(len(order))
+    return numbers
+
+# replaces the IDs in a table, -1 padded, with their new numbers
+def _translate(table, numbers):
+    return where(table >= 0, numbers[table], -1)
+
+# writes a grid and all smaller sizes to path, through a temporary file
+# renamed over it once complete, so that nothing loads a partly written file
+def save(grid, path):
+    levels = [level._tables() for level in _levels(grid)]
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(pack(header, magic, version, grid.size))
+        for faces, _, _, vertices, _, _ in levels:
+            f.write(pack(entry, len(faces), len(vertices)))
+        for _, facelocations, facevertices, _, vertexlocations, vertexfaces in levels:
+            faceorder, vertexorder = locationorder(facelocations), locationorder(vertexlocations)
+            facenumbers, vertexnumbers = _renumber(faceorder), _renumber(vertexorder)
+            for (datatype, _), data in zip(tables, (
+                    facelocations[faceorder], _translate(facevertices[faceorder], vertexnumbers),
+                    vertexlocations[vertexorder], _translate(vertexfaces[vertexorder], facenumbers))):
+                f.write(data.astype(datatype).tostring())
+                f.write('\0' * _padding(f.tell()))
+    rename(temp, path)
+
+def load(path):
+    with open(path, 'rb') as f:
+        filemagic, fileversion, size = unpack(header, f.read(calcsize(header)))
+        if filemagic != magic or fileversion != version:
+            raise ValueError('{} is not a version {} grid file'.format(path, version))
+        counts = [unpack(entry, f.read(calcsize(entry))) for _ in range(size + 1)]
+        offset = f.tell()
+
+    grid = None
+    for faces, vertices in counts:
+        arrays = []
+        for (datatype, width), rows in zip(tables, (faces, faces, vertices, vertices)):
+            if rows > 0:
+                # viewed as plain arrays, still mapped, to index rows
+                # without memmap's overhead
+                arrays.append(memmap(path, datatype, 'c', offset, (rows, width)).view(ndarray))
+            else:
+                arrays.append(zeros((0, width), datatype))
+            offset += rows * width * dtype(datatype).itemsize
+            offset += _padding(offset)
+        grid = ArrayGrid(grid, arrays)
+    return grid
@@ -0,0 +1,327 @@
+from os import remove
+from random import Random
+from struct import pack
+from tempfile import mkstemp
+from unittest import TestCase
+
+from arraygrid import ArrayGrid
+import gridfile
+from grid import dot, normal, Grid
+
+def build(cls, size):
+    grid = cls()
+    for _ in range(size):
+        grid = cls(grid)
+        grid.populate()
+    return grid
+
+def rotations(vertices):
+    return [vertices[i:] + vertices[:i] for i in range(len(vertices))]
+
+class GridTest(TestCase):
+    def test_subdividematchespopulate(self):
+        bulk, incremental = Grid(), Grid()
+        for _ in range(4):
+            bulk, incremental = Grid(bulk), Grid(incremental)
+            bulk.populate()
+            for face in incremental.prev.faces:
+                incremental.populate(face)
+            self.assertEqual(incremental.faces, bulk.faces)
+            self.assertEqual(incremental.vertices, bulk.vertices)
+
+    def test_populateafterlazy(self):
+        grid = Grid(build(Grid, 1))
+        grid.populate(grid.prev.faces.keys()[0])
+        grid.populate()
+        self.assertEqual(build(Grid, 2).faces, grid.faces)
+
+    def test_populatemany(self):
+        def lazy():
+            grid = Grid()
+            for _ in range(5):
+                grid = Grid(grid)
+            return grid
+        faces = sorted(build(Grid, 0).faces)[:3]
+        batch, single = lazy(), lazy()
+        batch.populate_many(faces)
+        for face in faces:
+            single.populate(face)
+        while batch is not None:
+            self.assertEqual(set(single.faces), set(batch.faces))
+            for face in batch.faces:
+                # the same tile, though it may start from another vertex
+                self.assertIn(batch.faces[face], rotations(single.faces[face]))
+            self.assertEqual(single.vertices, batch.vertices)
+            batch, single = batch.prev, single.prev
+
+    def test_deep(self):
+        # tiles made from each side of a vertex agree on it at any size
+        grid = Grid()
+        for _ in range(20):
+            grid = Grid(grid)
+        face = grid.locate(normal((1, 2, 3)))
+        grid.populateneighbors(face)
+        self.assertNotIn(None, grid.neighbors(face))
+        for vertex in grid.faces[face]:
+            self.assertEqual(3, len(grid.vertices[vertex]))
+
+    def test_progress(self):
+        def lazy():
+            grid = Grid(build(Grid, 1))
+            grid.populate(grid.prev.faces.keys()[0])
+            return grid
+        # populating a size after a lazy one populates it further, so each
+        # grid gets a previous size of its own
+        for prev in lambda: build(Grid, 2), lazy:
+            grid, expected = Grid(prev()), Grid(prev())
+            steps = []
+            grid.populate(progress=lambda done, total: steps.append((done, total)))
+            expected.populate()
+            self.assertEqual(expected.faces, grid.faces)
+            self.assertEqual(sorted(steps), steps)
+            self.assertEqual(steps[-1][0], steps[-1][1])
+
+    def test_abandon(self):
+        def stop(done, total):
+            if done > 0:
+                raise KeyboardInterrupt()
+        grid = Grid(build(Grid, 2))
+        self.assertRaises(KeyboardInterrupt, grid.populate, None, stop)
+
+    def test_abandonstoring(self):
+        # tiles are stored a few thousand at a time, reporting as they go
+        def stop(done, total):
+            if 3 * done > 2 * total:
+                raise KeyboardInterrupt()
+        prev = build(Grid, 5)
+        grid = Grid(prev)
+        self.assertRaises(KeyboardInterrupt, grid.populate, None, stop)
+        self.assertTrue(0 < len(grid.faces) < len(prev.faces) + len(prev.vertices))
+
+    def test_link(self):
+        prev = build(Grid, 1)
+        grid = Grid(prev, link=False)
+        grid.populate()
+        self.assertIsNone(prev._next)
+        grid.link()
+        self.assertIs(grid, prev._next)
+
+    def test_neighbors(self):
+        lazy = Grid(Grid(build(Grid, 1)))
+        lazy.populate(lazy.prev.prev.faces.keys()[0])
+        for grid in build(Grid, 3), lazy:
+            for face in grid.faces:
+                expected = []
+                for edge in grid.edges(face):
+                    common = grid.vertices[edge[0]] & grid.vertices[edge[1]]
+                    expected.append(list(common - { face })[0] if len(common) == 2 else None)
+                self.assertEqual(expected, grid.neighbors(face))
+                self.assertEqual(expected, [grid.neighbor(face, edge) for edge in grid.edges(face)])
+
+class AddressTest(TestCase):
+    def test_unique(self):
+        grid = build(Grid, 3)
+        addresses = [grid.address(face) for face in grid.faces]
+        self.assertEqual(len(grid.faces), len(set(addresses)))
+        for face, address in zip(grid.faces, addresses):
+            self.assertEqual(face, grid.face(address))
+
+    def test_children(self):
+        grid = build(Grid, 3)
+        children = []
+        for face in grid.prev.faces:
+            for child in grid.children(face):
+                self.assertEqual(face, grid.parent(child))
+                children.append(child)
+        self.assertEqual(sorted(grid.faces), sorted(children))
+
+    def test_ancestor(self):
+        grid = build(Grid, 3)
+        for face in grid.faces:
+            base = grid.ancestor(face, 0)
+            self.assertEqual(base, grid.prev.prev.parent(grid.prev.parent(grid.parent(face))))
+            self.assertEqual(grid.address(face) >> 9, grid.prev.prev.prev.address(base))
+
+    def test_lazy(self):
+        grid = build(Grid, 3)
+        lazy = Grid(Grid(Grid(Grid())))
+        for face in grid.faces.keys()[::17]:
+            self.assertEqual(face, lazy.face(grid.address(face)))
+
+class LocateTest(TestCase):
+    def vectors(self):
+        from random import Random
+        random = Random(0)
+        return [normal([random.gauss(0, 1) for _ in range(3)]) for _ in range(50)]
+
+    def test_locate(self):
+        grid = build(Grid, 4)
+        for vector in self.vectors():
+            nearest = max(grid.faces, key=lambda f: dot(f, vector))
+            self.assertEqual(nearest, grid.locate(vector))
+
+    def test_lazy(self):
+        grid = build(Grid, 4)
+        lazy = Grid(Grid(Grid(Grid(Grid()))))
+        for vector in self.vectors():
+            self.assertEqual(grid.locate(vector), lazy.locate(vector))
+        self.assertLess(len(lazy.faces), len(grid.faces))
+
+    def test_nearest_k(self):
+        grid = build(Grid, 3)
+        for vector in self.vectors():
+            expected = sorted(grid.faces, key=lambda f: -dot(f, vector))[:7]
+            self.assertEqual(expected, grid.nearest_k(vector, 7))
+
+class EvictionTest(TestCase):
+    def setUp(self):
+        self.full = build(Grid, 5)
+        grid = build(Grid, 2)
+        for _ in range(3):
+            grid = Grid(grid, 200)
+        self.grid = grid
+
+        # wander from tile to tile, jumping elsewhere now and then
+        random = Random(0)
+        face = grid.locate(normal((0, 0, 1)))
+        for step in range(200):
+            if step % 40 == 0:
+                face = grid.locate(normal([random.gauss(0, 1) for _ in range(3)]))
+            grid.populateneighbors(face)
+            face = random.choice([n for n in grid.neighbors(face) if n is not None])
+
+    def test_evicted(self):
+        self.assertTrue(self.grid.evictions > 0)
+        for size, tiles, budget in self.grid.resident()[3:]:
+            self.assertEqual(200, budget)
+            self.assertLessEqual(tiles, budget)
+
+    def test_consistent(self):
+        grid, full = self.grid, self.full
+        while grid is not None:
+            vertices = {}
+            for face, corners in grid.faces.iteritems():
+                # evicted tiles come back as they were
+                self.assertIn(corners, rotations(full.faces[face]))
+                self.assertEqual(full.address(face), grid.address(face))
+                for vertex in corners:
+                    vertices.setdefault(vertex, set()).add(face)
+            self.assertEqual(vertices, grid.vertices)
+            for face in grid.faces:
+                expected = []
+                for edge in grid.edges(face):
+                    common = grid.vertices[edge[0]] & grid.vertices[edge[1]]
+                    expected.append(list(common - { face })[0] if len(common) == 2 else None)
+                self.assertEqual(expected, grid.neighbors(face))
+            self.assertEqual(sorted(grid.faces), sorted(grid.changes()[0]))
+            grid, full = grid.prev, full.prev
+
+    def test_holds(self):
+        grid = self.grid
+        while grid.prev is not None and grid.prev.budget is not None:
+            # each tile the next size was subdivided from, or that is
+            # around one of its vertices, is held once per such tile
+            holds = {}
+            for face in grid.faces:
+                if face in grid.prev.faces:
+                    held = [face]
+                    for vertex in grid.prev.faces[face]:
+                        held.extend(grid.prev.vertices[vertex])
+                    for f in held:
+                        holds[f] = holds.get(f, 0) + 1
+            self.assertEqual(holds, grid.prev._holds)
+            grid = grid.prev
+
+    def test_repopulate(self):
+        grid, full = self.grid, self.full
+        face = grid.locate(normal((0, 0, 1)))
+        self.assertEqual(full.locate(normal((0, 0, 1))), face)
+        grid.populateneighbors(face)
+        self.assertEqual(set(full.neighbors(face)), set(grid.neighbors(face)))
+
+class ArrayGridTest(TestCase):
+    def test_sizes(self):
+        for size, faces in enumerate([12, 32, 92, 272]):
+            self.assertEqual(faces, len(build(ArrayGrid, size).faces))
+
+    def test_matchesgrid(self):
+        grid, arraygrid = [build(cls, 3) for cls in Grid, ArrayGrid]
+        self.assertEqual(set(grid.faces), set(arraygrid.faces))
+        self.assertEqual(set(grid.vertices), set(arraygrid.vertices))
+        for face, vertices in grid.faces.iteritems():
+            self.assertIn(arraygrid.faces[face], rotations(vertices))
+        for vertex, faces in grid.vertices.iteritems():
+            self.assertEqual(faces, arraygrid.vertices[vertex])
+
+    def test_pentagons(self):
+        grid = build(ArrayGrid, 2)
+        self.assertEqual(12, len([vs for vs in grid.faces.itervalues() if len(vs) == 5]))
+
+    def test_neighbor(self):
+        grid, arraygrid = [build(cls, 2) for cls in Grid, ArrayGrid]
+        for face in grid.faces:
+            for edge in grid.edges(face):
+                self.assertEqual(grid.neighbor(face, edge), arraygrid.neighbor(face, edge))
+
+    def test_lazy(self):
+        grid = ArrayGrid(ArrayGrid(ArrayGrid()))
+        face = grid.prev.prev.faces.keys()[0]
+        grid.populate(face)
+        self.assertIn(face, grid.faces)
+        self.assertLess(len(grid.faces), 92)
+
+class GridFileTest(TestCase):
+    def setUp(self):
+        _, self.path = mkstemp()
+
+    def tearDown(self):
+        remove(self.path)
+
+    def test_roundtrip(self):
+        grid = build(Grid, 3)
+        grid.save(self.path)
+        loaded = Grid.load(self.path)
+        while grid is not None:
+            self.assertEqual(grid.size, loaded.size)
+            self.assertEqual(set(grid.faces), set(loaded.faces))
+            for face, vertices in grid.faces.iteritems():
+                self.assertEqual(vertices, loaded.faces[face])
+            for vertex, faces in grid.vertices.iteritems():
+                self.assertEqual(faces, loaded.vertices[vertex])
+            grid, loaded = grid.prev, loaded.prev
+
+    def test_lookup(self):
+        grid = build(Grid, 2)
+        grid.save(self.path)
+        loaded = Grid.load(self.path)
+        for face, vertices in grid.faces.iteritems():
+            self.assertIn(face, loaded.faces)
+            self.assertEqual(vertices, loaded.faces[face])
+        for vertex in grid.vertices:
+            self.assertIn(vertex, loaded.vertices)
+        self.assertNotIn((0.0, 0.0, 2.0), loaded.faces)
+        self.assertNotIn((0.0, 0.0, 2.0), loaded.vertices)
+        # looked up from the mapped tables, without reading every location
+        self.assertIsNone(loaded._faceids._dict)
+        self.assertIsNone(loaded._vertexids._dict)
+
+    def test_version(self):
+        grid = build(Grid, 1)
+        grid.save(self.path)
+        with open(self.path, 'r+b') as f:
+            f.seek(len(gridfile.magic))
+            f.write(pack('<I', gridfile.version - 1))
+        self.assertRaises(ValueError, Grid.load, self.path)
+
+    def test_partial(self):
+        grid = Grid(Grid(Grid()))
+        grid.populate(grid.prev.prev.faces.keys()[0])
+        grid.save(self.path)
+        loaded = Grid.load(self.path)
+        self.assertEqual(set(grid.faces), set(loaded.faces))
+
+        # loaded grids keep growing lazily
+        face = loaded.prev.prev.faces.keys()[5]
+        grid.populate(face)
+        loaded.populate(face)
+        self.assertEqual(set(grid.faces), set(loaded.faces))
@@ -0,0 +1,83 @@
+from PySide.QtCore import QThread, Signal
+
+from colors.base import facecolors
+from grid import Grid
+
+class Cancelled(Exception):
+    pass
+
+# Builds the next size of a fully populated grid on a thread of its own
+#
+# The new grid is subdivided from prev, colored with provider so its colors
+# are cached before any view asks for them, if they fit in its cache, and
+# saved to path, if given.
+# Nothing else sees the new grid until it is done, and it is not linked to
+# prev: built is then emitted with it, for the UI thread to link and
+# publish in one step. progress is emitted with the steps done so far and
+# the total, populating taking the first half and coloring, chunksize tiles
+# at a time, the second.
+#
+# cancel abandons the work at the next report of progress, in which case
+# built is never emitted. finished is emitted either way.
+class SubdivideWorker(QThread):
+    progress = Signal(int, int)
+    built = Signal(object)
+
+    chunksize = 65536
+
+    def __init__(self, prev, provider, path=None, parent=None):
+        QThread.__init__(self, parent)
+        self.prev = prev
+        self.provider = provider
+        self.path = path
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _progress(self, done, total):
+        if self._cancelled:
+            raise Cancelled()
+        self.progress.emit(done, total)
+
+    def run(self):
+        grid = Grid(self.prev, link=False)
+        try:
+            grid.populate(progress=lambda done, total: self._progress(done, 2 * total))
+            provider = self.provider.forgrid(grid)
+            faces = list(grid.faces)
+            # coloring more than the cache holds would only evict the first
+            # of them again
+            if len(faces) <= getattr(provider, 'capacity', 0):
+                for start in range(0, len(faces), self.chunksize):
+                    self._progress(len(faces) + start, 2 * len(faces))
+                    facecolors(provider, faces[start:start + self.chunksize])
+            self._progress(1, 1)
+        except Cancelled:
+            return
+        if self.path is not None:
+            grid.save(self.path)
+        self.built.emit(grid)
+
+# Finds a provider's providers for grids on a thread of their own
+#
+# Providers for grids can take a while to make, such as those aggregating
+# raster cells over every tile, so the UI keeps its colors until ready is
+# emitted with the worker, once its colors hold the new providers in the
+# order of the grids. Partial grids may go on being populated meanwhile:
+# their scales are found here, on the thread populating them, and providers
+# copy what they need of them at once.
+class ColorWorker(QThread):
+    ready = Signal(object)
+
+    def __init__(self, provider, grids, parent=None):
+        QThread.__init__(self, parent)
+        self.provider = provider
+        self.grids = list(grids)
+        self.colors = None
+        for grid in self.grids:
+            grid.scale()
+
+    def run(self):
+        self.colors = [self.provider.forgrid(grid) for grid in self.grids]
+        self.ready.emit(self)
@@ -0,0 +1,148 @@
+# Runs the work behind the GUI without Qt or a display, reporting the cost
+# of each phase as JSON
+#
+#   python headless.py [size] [--lazy] [--providers gray,rgb,...]
+#                      [--output file] [--baseline file] [--tolerance 1.5]
+#
+# Builds grids up to size (default 6), fully or lazily around one face, then
+# colors the largest with each provider, lays out the detail view's tiles
+# around its first face and packs its sphere geometry. Each phase reports
+# its wall time in seconds, the peak resident set size of the process in
+# bytes so far, and the net number of objects allocated: blocks traced by
+# tracemalloc where it is available, or else objects tracked by the garbage
+# collector. Providers that cannot be loaded, for want of a module or data
+# file, are reported as skipped. The tiles held at each size are reported
+# as [size, tiles, budget] lists.
+#
+# Given a baseline report, exits with status 1 if any phase took more than
+# tolerance times as long as it did in the baseline.
+
+from argparse import ArgumentParser
+import gc
+from importlib import import_module
+import json
+from resource import getrusage, RUSAGE_SELF
+from sys import exit, platform, stderr, stdout
+from time import time
+
+from colors.base import facecolors
+from geometry import gridgeometry
+from grid import Grid
+from griddetail.layout import Layout
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+providers = ['earth', 'gray', 'rgb', 'simplex', 'vectorsimplex']
+
+def peakrss():
+    # Linux reports kilobytes, OS X bytes
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    return rss if platform == 'darwin' else rss * 1024
+
+def allocations():
+    if tracemalloc is not None:
+        return sum([stat.count for stat in tracemalloc.take_snapshot().statistics('filename')])
+    return len(gc.get_objects())
+
+# Times calls to a function as named phases of a report
+class Phases(object):
+    def __init__(self):
+        self.phases = []
+
+    def run(self, name, f, *args):
+        before = allocations()
+        start = time()
+        result = f(*args)
+        elapsed = time() - start
+        self.phases.append({
+            'name': name,
+            'seconds': elapsed,
+            'peakrss': peakrss(),
+            'allocations': allocations() - before})
+        return result
+
+def buildgrids(phases, size, lazy):
+    grid = Grid()
+    for n in range(1, size + 1):
+        grid = Grid(grid)
+        if lazy:
+            phases.run('populate:{}'.format(n), grid.populate, sorted(grid.prev.faces)[0])
+        else:
+            phases.run('populate:{}'.format(n), grid.populate)
+    return grid
+
+def colorgrid(grid, provider):
+    return facecolors(provider.forgrid(grid), list(grid.faces))
+
+def loadprovider(name):
+    return import_module('colors.' + name).Provider()
+
+def run(size, lazy, names):
+    if tracemalloc is not None:
+        tracemalloc.start()
+    phases = Phases()
+    grid = buildgrids(phases, size, lazy)
+
+    skipped = {}
+    for name in names:
+        try:
+            provider = loadprovider(name)
+        except (ImportError, EnvironmentError) as e:
+            skipped[name] = str(e)
+            continue
+        phases.run('colors:' + name, colorgrid, grid, provider)
+
+    face = sorted(grid.faces)[0]
+    edge = grid.edges(face)[0]
+    phases.run('layout', Layout, grid, face, 0, edge)
+    phases.run('geometry', gridgeometry, grid, loadprovider('gray'))
+
+    return {
+        'size': size,
+        'lazy': lazy,
+        'faces': len(grid.faces),
+        'resident': grid.resident(),
+        'phases': phases.phases,
+        'skipped': skipped}
+
+# phases taking more than tolerance times their time in the baseline, as
+# (name, seconds, baseline seconds) tuples
+def regressions(report, baseline, tolerance):
+    times = dict([(phase['name'], phase['seconds']) for phase in baseline['phases']])
+    return [(phase['name'], phase['seconds'], times[phase['name']])
+            for phase in report['phases']
+            if phase['name'] in times and phase['seconds'] > tolerance * times[phase['name']]]
+
+def main():
+    parser = ArgumentParser(description='Run grid, color, layout and geometry work headless.')
+    parser.add_argument('size', type=int, nargs='?', default=6)
+    parser.add_argument('--lazy', action='store_true', help='populate around one face only')
+    parser.add_argument('--providers', default=','.join(providers),
+                        help='comma-separated color provider modules')
+    parser.add_argument('--output', help='file to write the report to, instead of stdout')
+    parser.add_argument('--baseline', help='earlier report to compare times with')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='slowdown relative to the baseline that fails')
+    args = parser.parse_args()
+
+    report = run(args.size, args.lazy, [name for name in args.providers.split(',') if name])
+    if args.output is None:
+        json.dump(report, stdout, indent=2, sort_keys=True)
+        stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            slow = regressions(report, json.load(f), args.tolerance)
+        for name, seconds, before in slow:
+            print >> stderr, '{} took {:.3f}s, {:.3f}s in baseline'.format(name, seconds, before)
+        if len(slow) > 0:
+            exit(1)
+
+if __name__ == '__main__':
+    main()
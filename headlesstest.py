@@ -0,0 +1,115 @@
+from unittest import TestCase
+
+from grid import Grid
+from griddetail.layout import ahead, directions, inside, Layout
+from headless import regressions, run
+
+class HeadlessTest(TestCase):
+    def test_run(self):
+        report = run(3, False, ['gray', 'missing'])
+        self.assertEqual(272, report['faces'])
+        self.assertEqual(['populate:1', 'populate:2', 'populate:3', 'colors:gray', 'layout', 'geometry'],
+                         [phase['name'] for phase in report['phases']])
+        for phase in report['phases']:
+            self.assertTrue(phase['seconds'] >= 0)
+            self.assertTrue(phase['peakrss'] > 0)
+        self.assertEqual(['missing'], report['skipped'].keys())
+
+    def test_lazy(self):
+        report = run(3, True, ['rgb'])
+        self.assertTrue(report['faces'] < 272)
+
+    def test_regressions(self):
+        baseline = {'phases': [{'name': 'a', 'seconds': 1.0}, {'name': 'b', 'seconds': 1.0}]}
+        report = {'phases': [{'name': 'a', 'seconds': 1.2}, {'name': 'b', 'seconds': 2.0},
+                             {'name': 'c', 'seconds': 9.0}]}
+        self.assertEqual([('b', 2.0, 1.0)], regressions(report, baseline, 1.5))
+
+class LayoutTest(TestCase):
+    def setUp(self):
+        grid = Grid()
+        for _ in range(2):
+            grid = Grid(grid)
+            grid.populate()
+        self.grid = Grid(grid)
+        self.grid.populate(sorted(grid.faces)[0])
+
+    def test_layout(self):
+        grid = self.grid
+        face = [f for f in grid.faces if len(grid.faces[f]) == 6][0]
+        layout = Layout(grid, face, 0, grid.edges(face)[0])
+
+        self.assertEqual((face, (0, 0)), layout.tiles[0])
+        self.assertEqual((0, 0), layout.offset(face))
+        self.assertEqual(len(layout.tiles), len(layout.coords))
+        for f, coords in layout.tiles:
+            self.assertIn(f, grid.faces)
+            self.assertEqual(coords, layout.coords[f])
+            self.assertTrue(inside(coords))
+            q, r = coords
+            x, y = layout.offset(f)
+            self.assertAlmostEqual(12 * (q*q + q*r + r*r), x*x + y*y)
+        self.assertEqual([f for f, _ in layout.tiles if len(grid.faces[f]) == 5], layout.pents)
+
+    def test_neighbors(self):
+        # faces found in each direction from the center are its neighbors
+        grid = self.grid
+        face = [f for f in grid.faces if len(grid.faces[f]) == 6][0]
+        layout = Layout(grid, face, 0, grid.edges(face)[0])
+        around = set([layout.faces[direction] for direction in directions])
+        self.assertEqual(set(grid.neighbors(face)), around)
+
+    def test_pentagon(self):
+        grid = self.grid.prev
+        face = [f for f in grid.faces if len(grid.faces[f]) == 5][0]
+        layout = Layout(grid, face, 0, grid.edges(face)[0])
+        self.assertIn(face, layout.pents)
+        self.assertEqual(5, len(layout.shape(face)))
+        # the neighbors either side of the missing hex meet the pentagon's
+        # new vertex
+        vertex = layout.shape(face)[0]
+        coords = layout.coords[face]
+        adjacent = [layout.faces.get((coords[0] + q, coords[1] + r)) for q, r in directions]
+        distorted = [f for f in layout.shapes if f in adjacent]
+        self.assertTrue(len(distorted) > 0)
+        for f in distorted:
+            offset = [layout.offset(f)[i] - layout.offset(face)[i] for i in range(2)]
+            corners = [(x + offset[0], y + offset[1]) for x, y in layout.shape(f)]
+            self.assertTrue(min([abs(x - vertex[0]) + abs(y - vertex[1]) for x, y in corners]) < 1e-9)
+
+    def test_ahead(self):
+        grid = Grid(self.grid)
+        face = grid.locate(sorted(self.grid.faces)[0])
+        edge = grid.edges(face)[0]
+        layout = Layout(grid, face, 0, edge)
+        count = len(grid.faces)
+        faces = list(ahead(grid, face, 0, edge, 3))
+        self.assertTrue(len(grid.faces) > count)
+        self.assertTrue(len(faces) > 0)
+        for f in faces:
+            self.assertIn(f, grid.faces)
+            self.assertNotIn(f, layout.coords)
+
+        # moving the way it looked ahead needs nothing more populated
+        count = len(grid.faces)
+        following = layout.faces[directions[3]]
+        edge = [e for e in grid.edges(following) if set(e) <= set(grid.faces[face])][0]
+        Layout(grid, following, 0, edge)
+        self.assertEqual(count, len(grid.faces))
+
+    def test_pinned(self):
+        # a budget smaller than the layout and its walk ahead together
+        grid = Grid(self.grid.prev, 40)
+        face = grid.locate(sorted(self.grid.faces)[0])
+        edge = grid.edges(face)[0]
+        layout = Layout(grid, face, 0, edge)
+        walk = ahead(grid, face, 0, edge, 3)
+        for f in walk:
+            self.assertIn(f, grid.faces)
+            grid.locate(grid.prev.faces[sorted(grid.prev.faces)[-1]][0])
+        self.assertTrue(grid.evictions > 0)
+        for f in layout.coords:
+            self.assertIn(f, grid.faces)
+
+        layout.release()
+        self.assertEqual({}, grid._holds)
@@ -0,0 +1,131 @@
+# Lightweight timing spans and counters for the grid pipeline
+#
+# Instrumentation is off unless the HEYGRID_PROFILE environment variable is
+# set, in which case each interaction (see interaction) prints a report of
+# the time spent in each named span and the counters incremented during it
+# to stderr. If the variable names a .json file, every span and counter is
+# also written to it on exit as a Chrome trace, for chrome://tracing or
+# Perfetto.
+#
+# While disabled, span returns a shared do-nothing context manager and count
+# returns straight away, so the hooks can stay in hot paths.
+
+from atexit import register
+from collections import defaultdict
+from functools import wraps
+import json
+from os import environ, getpid
+from sys import stderr
+from thread import get_ident
+from time import time
+
+setting = environ.get('HEYGRID_PROFILE', '')
+enabled = len(setting) > 0
+tracefile = setting if setting.endswith('.json') else None
+
+# totals for the current interaction: span name -> [calls, seconds], and
+# counter name -> total
+spans = defaultdict(lambda: [0, 0.0])
+counters = defaultdict(int)
+
+# Chrome trace events, kept only when writing a trace
+events = []
+
+_epoch = time()
+
+def _microseconds(t):
+    return int((t - _epoch) * 1e6)
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_nullspan = _NullSpan()
+
+class _Span(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time()
+        return self
+
+    def __exit__(self, *exc):
+        end = time()
+        total = spans[self.name]
+        total[0] += 1
+        total[1] += end - self.start
+        if tracefile is not None:
+            events.append({
+                'name': self.name, 'ph': 'X', 'pid': getpid(), 'tid': get_ident(),
+                'ts': _microseconds(self.start), 'dur': _microseconds(end) - _microseconds(self.start)})
+        return False
+
+# context manager timing a named span of work
+def span(name):
+    return _Span(name) if enabled else _nullspan
+
+# adds n to a named counter
+def count(name, n=1):
+    if enabled:
+        counters[name] += n
+
+# text report of the spans and counters since the last reset
+def report(title):
+    lines = ['{}:'.format(title)]
+    for name, (calls, seconds) in sorted(spans.iteritems(), key=lambda item: -item[1][1]):
+        lines.append('  {:<32} {:>8} calls {:>10.3f}s'.format(name, calls, seconds))
+    for name, total in sorted(counters.iteritems()):
+        lines.append('  {:<32} {:>8}'.format(name, total))
+    return '\n'.join(lines)
+
+def reset():
+    spans.clear()
+    counters.clear()
+
+# interactions in progress: those started by another are part of it
+_interactions = []
+
+class _Interaction(_Span):
+    def __enter__(self):
+        if len(_interactions) == 0:
+            reset()
+        _interactions.append(self)
+        return _Span.__enter__(self)
+
+    def __exit__(self, *exc):
+        _Span.__exit__(self, *exc)
+        _interactions.pop()
+        if len(_interactions) > 0:
+            return False
+        if tracefile is not None:
+            events.append({
+                'name': 'counters', 'ph': 'C', 'pid': getpid(), 'tid': get_ident(),
+                'ts': _microseconds(time()), 'args': dict(counters)})
+        print >> stderr, report(self.name)
+        return False
+
+# context manager for a user interaction, reporting on the work it caused
+def interaction(name):
+    return _Interaction(name) if enabled else _nullspan
+
+# decorator reporting each call of a function as an interaction
+def interactive(name):
+    def decorate(f):
+        @wraps(f)
+        def call(*args, **kwargs):
+            with interaction(name):
+                return f(*args, **kwargs)
+        return call
+    return decorate
+
+# writes the events so far as a Chrome trace
+def dump(path):
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+if tracefile is not None:
+    register(dump, tracefile)
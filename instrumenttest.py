@@ -0,0 +1,74 @@
+import json
+from os import remove
+from tempfile import mkstemp
+from unittest import TestCase
+
+import instrument
+
+class InstrumentTest(TestCase):
+    def setUp(self):
+        self.saved = instrument.enabled, instrument.tracefile, instrument.stderr
+        instrument.enabled, instrument.tracefile = True, None
+        instrument.reset()
+        del instrument.events[:]
+        self.reports = []
+        class Output(object):
+            def write(output, text):
+                self.reports.append(text)
+        instrument.stderr = Output()
+
+    def tearDown(self):
+        instrument.enabled, instrument.tracefile, instrument.stderr = self.saved
+        instrument.reset()
+        del instrument.events[:]
+
+    def test_disabled(self):
+        instrument.enabled = False
+        with instrument.span('work'):
+            instrument.count('things')
+        with instrument.interaction('press'):
+            pass
+        self.assertEqual({}, dict(instrument.spans))
+        self.assertEqual({}, dict(instrument.counters))
+        self.assertEqual([], self.reports)
+
+    def test_spans(self):
+        for _ in range(3):
+            with instrument.span('work'):
+                instrument.count('things', 2)
+        self.assertEqual(3, instrument.spans['work'][0])
+        self.assertEqual(6, instrument.counters['things'])
+        self.assertIn('things', instrument.report('test'))
+
+    def test_interaction(self):
+        @instrument.interactive('inner')
+        def inner():
+            instrument.count('things')
+        with instrument.interaction('outer'):
+            inner()
+            inner()
+        # only the outermost interaction reports, on all the work within it
+        report = ''.join(self.reports)
+        self.assertTrue(report.startswith('outer:'))
+        self.assertIn('inner', report)
+        self.assertEqual(2, instrument.counters['things'])
+
+        with instrument.interaction('again'):
+            pass
+        self.assertEqual(0, instrument.counters['things'])
+
+    def test_trace(self):
+        _, path = mkstemp('.json')
+        try:
+            instrument.tracefile = path
+            with instrument.interaction('press'):
+                with instrument.span('work'):
+                    instrument.count('things')
+            instrument.dump(path)
+            with open(path) as f:
+                events = json.load(f)['traceEvents']
+        finally:
+            remove(path)
+        self.assertEqual(['work', 'press', 'counters'], [e['name'] for e in events])
+        self.assertEqual({'things': 1}, events[-1]['args'])
+        self.assertTrue(events[0]['ts'] >= events[1]['ts'])
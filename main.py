@@ -1,6 +1,7 @@
 from sys import argv, exit
 from PySide.QtGui import QApplication, QFont, QFontMetrics
 from mainwindow import MainWindow
+from screenpresenter import providers
 
 app = QApplication(argv)
 font = QFont(QApplication.font())
@@ -9,4 +10,9 @@ w = MainWindow()
 metrics = QFontMetrics(font)
 w.resize(metrics.width('M') * 80, metrics.height() * 24)
 w.show()
-exit(app.exec_())
+status = app.exec_()
+# the screen's workers were stopped as the application quit (see
+# ScreenPresenter.stop), so nothing is still using the providers
+for provider in providers:
+    provider.close()
+exit(status)
@@ -1,18 +1,51 @@
 # coding: utf-8
 
 from math import acos, log10
-from random import choice
+from os import makedirs
+from os.path import dirname, exists, realpath
 
-from PySide.QtCore import QEvent
-from PySide.QtGui import QFont, QKeyEvent, QWidget, QWidgetItem
+from PySide.QtCore import QEvent, Qt
+from PySide.QtGui import QApplication, QFont, QKeyEvent, QWidget, QWidgetItem
 
 from grid import dot, normal, Grid
-from griddetail import GridDetail
+from griddetail import GridDetail, Prefetcher
+from gridworker import ColorWorker, SubdivideWorker
+import instrument
 from sphereview import SphereView
 
-from colors import earth, gray, rgb, simplex
-
-providers = sorted([m.Provider() for m in earth, gray, rgb, simplex], key=lambda p: p.name)
+from colors import earth, gray, rgb, simplex, vectorsimplex
+from colors.cache import Cache
+from colors.parallel import Parallel
+
+# each provider's colors are cached for both sphere views and the detail view,
+# noise being computed a tile at a time so spread across processes
+providers = sorted([Cache(p) for p in
+                    earth.Provider(),
+                    earth.Provider(aggregate='mean'),
+                    gray.Provider(),
+                    rgb.Provider(),
+                    Parallel(simplex.Provider()),
+                    vectorsimplex.Provider()], key=lambda p: p.name)
+
+# fully populated grids are deterministic, so are cached between runs
+cachedir = dirname(realpath(__file__)) + '/grids'
+
+# tiles kept of each lazily populated size, which is plenty for the detail
+# view and prefetching around it
+lazybudget = 2**16
+
+def cachefile(size):
+    return '{}/{}.bin'.format(cachedir, size)
+
+# the cached grid hierarchy up to a size, or None if there is none written
+# in the current format
+def cached(size):
+    if not exists(cachefile(size)):
+        return None
+    try:
+        return Grid.load(cachefile(size))
+    except ValueError:
+        return None
 
 def mid(v1, v2):
     return normal([(v1[i]+v2[i])/2 for i in range(3)])
@@ -25,6 +58,12 @@ class ScreenPresenter(object):
 
         self.grids = []
         self.colors = []
+        self._colorindex = 0
+        self._views = []
+        # the worker finding the colors to show next, and any others still
+        # running
+        self._colorworker = None
+        self._colorworkers = []
 
         self._view = view
 
@@ -37,6 +76,10 @@ class ScreenPresenter(object):
 
         self._lastdepth = -1
         self._detail = None
+        self._worker = None
+        # populates lazy grids ahead of the detail view as it moves
+        self._prefetch = Prefetcher()
+        self._prefetch.populated.connect(self._populated)
         self.add()
 
         view.layer.sliderMoved.connect(self.layer)
@@ -73,6 +116,18 @@ class ScreenPresenter(object):
 
         self._uistack = uistack
 
+        # before the providers the workers use are closed
+        QApplication.instance().aboutToQuit.connect(self.stop)
+
+    # cancels building a grid, and waits for it and for any colors being
+    # found, so that nothing is left using the providers
+    def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker.wait()
+        for worker in self._colorworkers:
+            worker.wait()
+
     def hidedetail(self):
         for i in range(self._view.grid.count()):
             item = self._view.grid.itemAt(i)
@@ -91,8 +146,12 @@ class ScreenPresenter(object):
         self._view.grid.setRowStretch(self._detailPosition[0], 1)
         self._view.hideDetail.setVisible(True)
 
+    @instrument.interactive('key')
     def key(self, event):
-        facecount = len(self._detail.grid.faces)
+        if self._detail is None:
+            return
+        grid = self._detail.grid
+        before = len(grid.faces), grid.evictions
         try:
             direction = {
                 u"'": 'NW',
@@ -116,16 +175,41 @@ class ScreenPresenter(object):
                 detail = self._detail.rotate(rotation)
             else:
                 detail = self._detail
-        self._detail = detail
-        self._detailview.setScene(self._detail.scene)
-        if len(self._detail.grid.faces) != facecount:
-            for v in self._views:
-                v.update()
-                v.redraw()
+        self._setdetail(detail)
+        if (len(grid.faces), grid.evictions) != before:
+            self._populated()
 
+    def _populated(self):
+        for v in self._views:
+            v.update()
+            v.redraw()
+
+    # recolors with a provider, finding its providers for the grids in the
+    # background: the views keep their colors until it is done
+    @instrument.interactive('color change')
     def colorchange(self, index):
-        self.colors = [providers[index] for _ in self.grids]
+        self._colorindex = index
+        worker = self._colorworker = ColorWorker(providers[index], self.grids)
+        self._colorworkers.append(worker)
+        # queued, so the handler runs on this thread
+        worker.ready.connect(self._colored, Qt.QueuedConnection)
+        worker.start()
+
+    @instrument.interactive('color ready')
+    def _colored(self, worker):
+        worker.wait()
+        self._colorworkers.remove(worker)
+        if worker is not self._colorworker:
+            return
+        self._colorworker = None
+
+        # the largest grid is shown once it has colors
+        for l in self._view.layer, self._view.detailLayer:
+            l.setMaximum(self.grids[-1].size)
+            if l.value() == self.grids[-1].size - 1:
+                l.setValue(self.grids[-1].size)
 
+        self.colors = worker.colors
         while self._view.angles.count() > 0:
             self._view.angles.takeAt(0).widget().deleteLater()
         self._views = [SphereView(self.grids[-1], self.colors, offset, self._view, self._view.layer.value()) for offset in (0, 180)]
@@ -134,21 +218,64 @@ class ScreenPresenter(object):
 
         self.detaillayer(self._view.detailLayer.value())
 
+    # adds the next grid size, building a full size in the background: while
+    # it builds, the add button cancels it instead
+    @instrument.interactive('add')
     def add(self):
-        self.grids.append(Grid(self.grids[-1]) if len(self.grids) > 0 else Grid())
-        if self.grids[-1].prev is not None:
-            if self._view.lazy.isChecked():
-                self._view.lazy.setEnabled(False)
-                self.grids[-1].populate(self.grids[-1].prev.faces.keys()[3])
-            else:
-                self.grids[-1].populate()
-
-        for l in self._view.layer, self._view.detailLayer:
-            l.setMaximum(self.grids[-1].size)
-            if l.value() == self.grids[-1].size - 1:
-                l.setValue(self.grids[-1].size)
-
-        self.colorchange(providers.index(self.colors[0]) if len(self.colors) > 0 else 0)
+        if self._worker is not None:
+            self._worker.cancel()
+            return
+
+        lazy = self._view.lazy.isChecked()
+        grid = cached(len(self.grids)) if not lazy else None
+        if grid is not None:
+            self.grids = []
+            while grid is not None:
+                self.grids.insert(0, grid)
+                grid = grid.prev
+        elif len(self.grids) == 0:
+            self.grids.append(Grid())
+        elif lazy:
+            self._view.lazy.setEnabled(False)
+            self.grids.append(Grid(self.grids[-1], lazybudget))
+            self.grids[-1].populate(self.grids[-1].prev.faces.keys()[3])
+        else:
+            self._build()
+            return
+        self._published()
+
+    def _build(self):
+        if not exists(cachedir):
+            makedirs(cachedir)
+        prev = self.grids[-1]
+        worker = self._worker = SubdivideWorker(prev, providers[self._colorindex], cachefile(prev.size + 1))
+        # queued, so the handlers run on this thread
+        worker.progress.connect(self._building, Qt.QueuedConnection)
+        worker.built.connect(self._built, Qt.QueuedConnection)
+        worker.finished.connect(self._finished, Qt.QueuedConnection)
+        self._view.lazy.setEnabled(False)
+        self._building(0, 1)
+        worker.start()
+
+    def _building(self, done, total):
+        self._view.add.setText(u'Cancel ({}%)'.format(100 * done // total))
+
+    @instrument.interactive('add built')
+    def _built(self, grid):
+        if grid.prev is self.grids[-1]:
+            grid.link()
+            self.grids.append(grid)
+            self._published()
+
+    def _finished(self):
+        self._worker.wait()
+        self._worker = None
+        self._view.add.setText(u'Add Layer')
+        self._view.lazy.setEnabled(True)
+
+    # shows a new largest grid, once it has colors
+    def _published(self):
+        self.colorchange(self._colorindex)
 
     def layer(self, depth):
         for v in self._views:
@@ -185,34 +312,45 @@ class ScreenPresenter(object):
         label1, label10 = [self.labelscale(o, unit) for o in (order, order+1)]
         return dth, label1, label10
 
+    @instrument.interactive('detail layer')
     def detaillayer(self, depth):
+        if depth >= len(self.colors):
+            return
         if self._detail is None:
             face = self.grids[depth].faces.keys()[0]
             orientation = None
         else:
             face = self._detail.center
             lastdepth = self._lastdepth
-            while lastdepth > depth:
-                lastdepth -= 1
-                if face not in self.grids[lastdepth].faces:
-                    face = choice(list(self.grids[lastdepth].vertices[face]))
-            if face not in self.grids[depth].faces:
-                self.grids[depth].populate(face)
+            if depth < lastdepth:
+                face = self.grids[lastdepth].ancestor(face, depth)
+            else:
+                address = self.grids[lastdepth].address(face)
+                face = self.grids[depth].face(address << 3 * (depth - lastdepth))
             direction, edge = self._detail.orientation
             edgemid = mid(*edge)
             edge = min(self.grids[depth].edges(face), key=lambda e: abs(acos(dot(edgemid, mid(*e)))))
             orientation = (direction, edge)
-        self._detail = GridDetail(self.grids[depth], self.colors[depth], face, ((0,-1,0), u'N'), self.scale(self.grids[depth], 6371000, u'm'), orientation)
-        self._detailview.setScene(self._detail.scene)
+        self._setdetail(GridDetail(self.grids[depth], self.colors[depth], face, ((0,-1,0), u'N'), self.scale(self.grids[depth], 6371000, u'm'), orientation))
         self._lastdepth = depth
 
+    @instrument.interactive('pentagon')
     def pentagon(self):
-        face = min(self.grids[0].faces.keys(), key=lambda f: abs(acos(dot(f, self._detail.center))))
+        if self._detail is None:
+            return
         depth = self._lastdepth
-        if face not in self.grids[depth].faces:
-            self.grids[depth].populate(face)
-        self._detail = GridDetail(self.grids[depth], self.colors[depth], face, ((0,-1,0), u'N'), self.scale(self.grids[depth], 6371000, u'm'))
-        self._detailview.setScene(self._detail.scene)
+        base = self.grids[0].address(self.grids[0].locate(self._detail.center))
+        face = self.grids[depth].face(base << 3 * depth)
+        self._setdetail(GridDetail(self.grids[depth], self.colors[depth], face, ((0,-1,0), u'N'), self.scale(self.grids[depth], 6371000, u'm')))
+
+    # shows a detail view, letting the grid evict the tiles of the one it
+    # replaces, and prefetches ahead of it
+    def _setdetail(self, detail):
+        if self._detail is not None and self._detail is not detail:
+            self._detail.close()
+        self._detail = detail
+        self._detailview.setScene(detail.scene)
+        self._prefetch.follow(detail)
 
     def rotate(self, value):
         for v in self._views:
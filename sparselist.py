@@ -1,38 +1,88 @@
+from bisect import bisect_left, insort
+
 ##
 # Class implementing a sparse list optimized for iteration and random-access
 #
-# Insertions are linear in complexity
+# Values are kept in a dictionary by index for constant-time access, and the
+# set indices in a list of sorted chunks (in the manner of blist or
+# SortedList) for in-order iteration. Insertions bisect the chunk maxima and
+# then a single chunk, splitting chunks that outgrow the load factor, so are
+# logarithmic in complexity plus a bounded copy within the chunk.
 class splist(object):
+	_load = 1000
+
 	def __init__(self, items=None):
-		self._head, self._index = None, {}
+		self._values, self._chunks, self._maxes = {}, [], []
 		items = [] if items is None else items
-		for (i, value) in zip(range(len(items)), items):
-			self[i] = value
+		self._extend(zip(range(len(items)), items))
+
+	##
+	# Builds a sparse list from (index, value) pairs in any order
+	@classmethod
+	def fromitems(cls, items):
+		l = cls()
+		l._extend(items)
+		return l
+
+	def _extend(self, items):
+		self._values.update(items)
+		indices = sorted(self._values)
+		self._chunks = [indices[i:i + self._load] for i in range(0, len(indices), self._load)]
+		self._maxes = [chunk[-1] for chunk in self._chunks]
+
+	def __len__(self):
+		return len(self._values)
 
 	def __iter__(self):
-		item = self._head
-		while item is not None:
-			yield item.value
-			item = item.next
+		for _, value in self.iteritems():
+			yield value
 
-	def __getitem__(self, i):
-		return self._index[i].value if i in self._index else None
+	def iteritems(self):
+		return self.irange()
 
-	@staticmethod
-	def _insert(list, index, i, value):
-		if list is not None and list.i < i:
-			next, index = splist._insert(list.next, index, i, value)
-			return splist.Entry(list.i, list.value, next), index
-		else:
-			next = list.next if list is not None and list.i == i else list
-			entry = splist.Entry(i, value, next)
-			return entry, dict(index.items() + { i: entry }.items())
+	##
+	# Iterates over (index, value) pairs of set indices in [start, stop)
+	def irange(self, start=None, stop=None):
+		k, j = 0, 0
+		if start is not None:
+			k = bisect_left(self._maxes, start)
+			if k < len(self._chunks):
+				j = bisect_left(self._chunks[k], start)
+		for chunk in self._chunks[k:]:
+			for i in chunk[j:]:
+				if stop is not None and i >= stop:
+					return
+				yield i, self._values[i]
+			j = 0
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			if i.step is not None:
+				raise ValueError('sparse list slices do not support steps')
+			return [value for _, value in self.irange(i.start, i.stop)]
+		return self._values.get(i)
 
 	def __setitem__(self, i, value):
-		self._head, self._index = self._insert(self._head, self._index, i, value)
+		if i not in self._values:
+			self._insert(i)
+		self._values[i] = value
+
+	def _insert(self, i):
+		if len(self._chunks) == 0:
+			self._chunks.append([i])
+			self._maxes.append(i)
+			return
+
+		k = bisect_left(self._maxes, i)
+		if k == len(self._chunks):
+			# past the end: append to the last chunk
+			k -= 1
+			self._chunks[k].append(i)
+			self._maxes[k] = i
+		else:
+			insort(self._chunks[k], i)
 
-	class Entry(object):
-		def __init__(self, i, value, next=None):
-			self.i = i
-			self.value = value
-			self.next = next
+		chunk = self._chunks[k]
+		if len(chunk) > 2 * self._load:
+			self._chunks[k:k + 1] = [chunk[:self._load], chunk[self._load:]]
+			self._maxes[k:k + 1] = [chunk[self._load - 1], chunk[-1]]
@@ -0,0 +1,39 @@
+# Times random insertion, random access and iteration of a sparse list
+#
+#   python sparselistbenchmark.py [count]
+#
+# count (default 10^6) values are set at random indices below 10^9.
+
+from random import Random
+from sys import argv
+from time import time
+
+from sparselist import splist
+
+def timed(label, count, f):
+	start = time()
+	f()
+	elapsed = time() - start
+	print '{:<10} {:>10.3f}s {:>14.0f}/s'.format(label, elapsed, count / elapsed)
+
+def main(count):
+	random = Random(0)
+	indices = [random.randrange(10 ** 9) for _ in xrange(count)]
+	l = splist()
+
+	def insert():
+		for i in indices:
+			l[i] = i
+	def access():
+		for i in indices:
+			l[i]
+	def iterate():
+		for _ in l:
+			pass
+
+	timed('insert', count, insert)
+	timed('access', count, access)
+	timed('iterate', len(l), iterate)
+
+if __name__ == '__main__':
+	main(int(argv[1]) if len(argv) > 1 else 10 ** 6)
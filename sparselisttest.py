@@ -75,3 +75,33 @@ class SparseListTest(TestCase):
 		l1[100] = 17
 		l2[100000] = 17
 		self.assertEqual(usage(l1), usage(l2))
+
+	def test_len(self):
+		l = splist('abc')
+		l[10] = 'd'
+		self.assertEqual(4, len(l))
+
+	def test_fromitems(self):
+		l = splist.fromitems([(7, 'c'), (2, 'a'), (5, 'b')])
+		self.assertEqual(['a','b','c'], [item for item in l])
+		self.assertEqual('b', l[5])
+
+	def test_slice(self):
+		l = splist.fromitems([(i * 3, i) for i in range(10)])
+		self.assertEqual([2,3,4], l[6:15])
+		self.assertEqual([0,1], l[:6])
+		self.assertEqual([8,9], l[24:])
+
+	def test_irange(self):
+		l = splist.fromitems([(i * 3, i) for i in range(10)])
+		self.assertEqual([(3,1),(6,2)], list(l.irange(1, 7)))
+
+	def test_manyinserts(self):
+		from random import Random
+		random = Random(0)
+		indices = random.sample(xrange(10 ** 6), 5000)
+		l = splist()
+		for i in indices:
+			l[i] = -i
+		self.assertEqual([-i for i in sorted(indices)], [item for item in l])
+		self.assertEqual(-indices[0], l[indices[0]])
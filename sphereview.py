@@ -1,18 +1,61 @@
 #!/usr/bin/env python
 
-import math
 from OpenGL import GL
+from OpenGL.arrays import vbo
 from PySide import QtCore, QtOpenGL
 
-def squared_length(v):
-    return sum([vi * vi for vi in v])
-
-def length(v):
-    return math.sqrt(squared_length(v))
+from geometry import stride, tilevertices, tiletriangles, TileArrays
+import instrument
+
+# GPU copy of a grid's tiles, kept in step with the grid as it is populated
+#
+# Tiles added since the last update are appended to growable arrays and
+# only their part of the buffers is uploaded, unless the arrays had to grow.
+# Once the grid has evicted tiles, the arrays are built again from the
+# tiles left.
+class GridBuffers(object):
+    def __init__(self, grid, colors):
+        self.grid = grid
+        self.colors = colors
+        self.changes = 0
+        self.evictions = grid.evictions
+        self.tiles = TileArrays()
+        self.vertices = vbo.VBO(self.tiles.vertices)
+        self.indices = vbo.VBO(self.tiles.indices, target=GL.GL_ELEMENT_ARRAY_BUFFER)
 
-def normal(v):
-    d = 1.0 / length(v)
-    return tuple([vi * d for vi in v])
+    def update(self):
+        if self.grid.evictions != self.evictions:
+            self.evictions = self.grid.evictions
+            self.changes = 0
+            self.tiles = TileArrays()
+            self.vertices.set_array(self.tiles.vertices)
+            self.indices.set_array(self.tiles.indices)
+        faces, self.changes = self.grid.changes(self.changes)
+        if len(faces) == 0:
+            return
+        with instrument.span('sphere buffers'):
+            tiles = self.tiles
+            first, grown = tiles.extend(faces, [self.grid.faces[face] for face in faces], self.colors)
+            if grown:
+                self.vertices.set_array(tiles.vertices)
+                self.indices.set_array(tiles.indices)
+            else:
+                start, end = first * tilevertices, tiles.count * tilevertices
+                self.vertices[start:end] = tiles.vertices[start:end]
+                start, end = [n * tiletriangles * 3 for n in first, tiles.count]
+                self.indices[start:end] = tiles.indices[start:end]
+        instrument.count('gl vertices', len(faces) * tilevertices)
+
+    def draw(self):
+        size = self.tiles.vertices.itemsize
+        self.vertices.bind()
+        GL.glVertexPointer(3, GL.GL_FLOAT, stride * size, self.vertices)
+        GL.glNormalPointer(GL.GL_FLOAT, stride * size, self.vertices + 3 * size)
+        GL.glColorPointer(3, GL.GL_FLOAT, stride * size, self.vertices + 6 * size)
+        self.indices.bind()
+        GL.glDrawElements(GL.GL_TRIANGLES, self.tiles.count * tiletriangles * 3, GL.GL_UNSIGNED_INT, self.indices)
+        self.indices.unbind()
+        self.vertices.unbind()
 
 class SphereView(QtOpenGL.QGLWidget):
     def __init__(self, grid, colors, rotationoffset, parent, index):
@@ -34,7 +77,7 @@ class SphereView(QtOpenGL.QGLWidget):
         return QtCore.QSize(400, 400)
 
     def layer(self, index):
-        if self.objects[index] != self.objects[self.index]:
+        if index != self.index:
             self.index = index
             self.updateGL()
 
@@ -53,13 +96,19 @@ class SphereView(QtOpenGL.QGLWidget):
         GL.glEnable(GL.GL_LIGHTING)
         GL.glEnable(GL.GL_LIGHT0)
         GL.glEnable(GL.GL_LIGHT1)
+        # tile colors come from the vertex arrays
+        GL.glEnable(GL.GL_COLOR_MATERIAL)
+        GL.glColorMaterial(GL.GL_FRONT, GL.GL_DIFFUSE)
+        for state in GL.GL_VERTEX_ARRAY, GL.GL_NORMAL_ARRAY, GL.GL_COLOR_ARRAY:
+            GL.glEnableClientState(state)
 
+    # brings each layer's buffers up to date with tiles added to its grid
     def update(self):
         grid = self.grid
         for i in range(len(self.objects) - 1, -1, -1):
-            if self.objects[i] is not None:
-                GL.glDeleteLists(self.objects[i], 1)
-            self.objects[i] = self.makeGrid(grid, self.colors[i])
+            if self.objects[i] is None:
+                self.objects[i] = GridBuffers(grid, self.colors[i])
+            self.objects[i].update()
             grid = grid.prev
 
     def redraw(self):
@@ -78,7 +127,7 @@ class SphereView(QtOpenGL.QGLWidget):
         GL.glRotated(self.xRot / 16.0, 1.0, 0.0, 0.0)
         GL.glRotated(self.yRot / 16.0, 0.0, 1.0, 0.0)
         GL.glRotated(self.zRot / 16.0, 0.0, 0.0, 1.0)
-        GL.glCallList(self.objects[self.index])
+        self.objects[self.index].draw()
 
     def resizeGL(self, width, height):
         side = min(width, height)
@@ -89,25 +138,6 @@ class SphereView(QtOpenGL.QGLWidget):
         GL.glOrtho(-1.1, 1.1, 1.1, -1.1, 0, 11)
         GL.glMatrixMode(GL.GL_MODELVIEW)
 
-    def makeGrid(self, grid, colors):
-        genList = GL.glGenLists(1)
-        GL.glNewList(genList, GL.GL_COMPILE)
-
-        for t, vs in grid.faces.iteritems():
-            color = colors[t]
-            GL.glMaterialfv(GL.GL_FRONT, GL.GL_DIFFUSE, color)
-            GL.glBegin(GL.GL_TRIANGLE_FAN)
-            n = normal(t)
-            GL.glNormal3d(*n)
-            GL.glVertex3d(*t)
-            for c in vs + [vs[0]]:
-                GL.glVertex3d(*c)
-            GL.glEnd()
-
-        GL.glEndList()
-
-        return genList
-
     def normalizeAngle(self, angle):
         while angle < 0:
             angle += 360 * 16